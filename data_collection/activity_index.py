@@ -0,0 +1,155 @@
+"""Inverted index from activity words to sample positions in a user's sample file.
+
+The index is kept up to date by the bot as samples are saved and can be
+rebuilt offline by running this module over the data directory.
+"""
+import json
+import logging
+import sys
+from bisect import bisect_left
+from pathlib import Path
+
+from samples import iter_sample_lines, parse_sample_line
+
+INDEX_SUFFIX = ".index.json"
+
+
+class ActivityIndex():
+    def __init__(self):
+        # Sample position -> sample time (POSIX seconds), in file order.
+        # Replies are saved at reply time, so this is only nearly ascending.
+        self.times = []
+        # Lower-case word -> ascending sample positions
+        self.postings = {}
+        # Number of bytes of the sample file covered by the index
+        self.indexed_bytes = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def add_line(self, line):
+        record = parse_sample_line(line)
+        first_position = len(self.times)
+        self.times.extend(sample.time.timestamp() for sample in record.expand())
+        positions = range(first_position, len(self.times))
+        for word in set(record.label.lower().split()):
+            self.postings.setdefault(word, []).extend(positions)
+        self.indexed_bytes += len(line.encode())
+
+    def update_from_file(self, path):
+        """Index lines written to path since the last update, return how many"""
+        n_added = 0
+        if Path(path).exists():
+            for offset, line in iter_sample_lines(path, self.indexed_bytes):
+                self.add_line(line)
+                n_added += 1
+        return n_added
+
+    def get_position_range(self, start=None, end=None):
+        """Positions [low, high) of samples with start <= time < end (datetimes)"""
+        low = 0 if start is None else bisect_left(self.times, start.timestamp())
+        high = len(self.times) if end is None else bisect_left(self.times, end.timestamp())
+        return low, high
+
+    def get_word_positions(self, word, low, high):
+        positions = self.postings.get(word.lower(), [])
+        return positions[bisect_left(positions, low):bisect_left(positions, high)]
+
+    def find(self, all_of=(), any_of=(), start=None, end=None):
+        """Sorted positions of samples containing every word in all_of and,
+        if any_of is given, at least one word in any_of
+        """
+        low, high = self.get_position_range(start, end)
+        candidates = None
+        if all_of:
+            word_lists = sorted((self.get_word_positions(w, low, high) for w in all_of), key=len)
+            candidates = word_lists[0]
+            for positions in word_lists[1:]:
+                position_set = set(positions)
+                candidates = [p for p in candidates if p in position_set]
+        if any_of:
+            matches = set()
+            for word in any_of:
+                matches.update(self.get_word_positions(word, low, high))
+            if candidates is None:
+                candidates = sorted(matches)
+            else:
+                candidates = [p for p in candidates if p in matches]
+        if candidates is None:
+            candidates = list(range(low, high))
+        return candidates
+
+    def get_share(self, all_of=(), any_of=(), start=None, end=None):
+        """Return (matching samples, samples in time range)"""
+        low, high = self.get_position_range(start, end)
+        n_matching = len(self.find(all_of, any_of, start, end))
+        return n_matching, high - low
+
+    def to_dict(self):
+        return {
+            "indexed_bytes": self.indexed_bytes,
+            "times": self.times,
+            "postings": self.postings
+        }
+
+    @classmethod
+    def from_dict(cls, index_dict):
+        index = cls()
+        index.indexed_bytes = index_dict["indexed_bytes"]
+        index.times = index_dict["times"]
+        index.postings = index_dict["postings"]
+        return index
+
+    def save(self, index_path):
+        with open(index_path, 'w') as fp:
+            json.dump(self.to_dict(), fp)
+
+    @classmethod
+    def load(cls, index_path):
+        with open(index_path, 'r') as fp:
+            return cls.from_dict(json.load(fp))
+
+
+def get_index_path(sample_path):
+    sample_path = Path(sample_path)
+    return sample_path.with_name(sample_path.stem + INDEX_SUFFIX)
+
+
+def load_index(sample_path):
+    """Load the saved index of sample_path and catch up with new lines.
+
+    The index is rebuilt if it is missing, unreadable or covers more bytes
+    than the sample file has.
+    """
+    index_path = get_index_path(sample_path)
+    index = None
+    if index_path.exists():
+        try:
+            index = ActivityIndex.load(index_path)
+        except (ValueError, KeyError):
+            logging.warning("Discarding unreadable index %s", index_path)
+    if index is None or (Path(sample_path).exists() and
+                         index.indexed_bytes > Path(sample_path).stat().st_size):
+        index = ActivityIndex()
+    if index.update_from_file(sample_path) > 0 or not index_path.exists():
+        index.save(index_path)
+    return index
+
+
+def rebuild_index(sample_path):
+    index = ActivityIndex()
+    index.update_from_file(sample_path)
+    index.save(get_index_path(sample_path))
+    return index
+
+
+def main():
+    """Rebuild the indexes of all sample files in the given data directory"""
+    data_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).absolute().parent.joinpath("data")
+    for sample_path in sorted(data_dir.glob("*.csv")):
+        index = rebuild_index(sample_path)
+        print("{}: {} samples, {} words".format(sample_path.name, len(index), len(index.postings)))
+
+
+if __name__ == '__main__':
+    main()
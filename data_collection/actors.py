@@ -0,0 +1,75 @@
+"""Per-user serialized execution of bot work.
+
+Every user gets a queue of coroutines that are run one at a time in
+submission order, so handlers never interleave on a user's state. Different
+users run concurrently, at most max_workers at a time. Most work is
+submitted from callbacks that don't wait for it, so failures are logged
+here as they happen.
+"""
+import asyncio
+import collections
+import logging
+
+MAX_CONCURRENT_USERS = 32
+
+
+class UserActors():
+    def __init__(self, max_workers=MAX_CONCURRENT_USERS):
+        self.max_workers = max_workers
+        self.queues = {}
+        self.workers = {}
+        self.semaphore = None
+
+    def get_queue_depth(self, key=None):
+        if key is not None:
+            return len(self.queues.get(key, ()))
+        return sum(len(queue) for queue in self.queues.values())
+
+    def submit(self, key, coro):
+        """Queue coro to run after all earlier work for key.
+        Returns a future with the result of coro. Exceptions are logged and
+        also set on the future, which may be left unawaited.
+        """
+        loop = asyncio.get_event_loop()
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_workers)
+        future = loop.create_future()
+        queue = self.queues.setdefault(key, collections.deque())
+        queue.append((coro, future))
+        if key not in self.workers:
+            self.workers[key] = loop.create_task(self.run_actor(key))
+        return future
+
+    async def run_actor(self, key):
+        queue = self.queues[key]
+        try:
+            while queue:
+                coro, future = queue.popleft()
+                # The worker slot is taken per item so that one busy user
+                # can't hold it while others wait
+                async with self.semaphore:
+                    try:
+                        result = await coro
+                    except asyncio.CancelledError:
+                        future.cancel()
+                        raise
+                    except Exception as e:
+                        logging.exception("Work for %s failed", key)
+                        if not future.cancelled():
+                            future.set_exception(e)
+                            # Already logged, don't warn again when it's dropped
+                            future.exception()
+                    else:
+                        if not future.cancelled():
+                            future.set_result(result)
+        finally:
+            for coro, future in queue:
+                coro.close()
+                future.cancel()
+            del self.queues[key]
+            del self.workers[key]
+
+    async def join(self):
+        """Wait until all queued work is done"""
+        while self.workers:
+            await asyncio.gather(*self.workers.values(), return_exceptions=True)
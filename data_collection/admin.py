@@ -0,0 +1,235 @@
+"""Read-only inspection of the bot's user states and sample files.
+
+Safe to run next to the bot: files are only opened for reading, memory
+mapped and read from the end where possible, and nothing is locked. A sample
+line still being written is skipped. No Matrix client is involved.
+
+Usage:
+    admin.py [--data-dir DIR] list [--state none|activity_wait|room_switch_wait]
+    admin.py [--data-dir DIR] overdue [--grace MINUTES]
+    admin.py [--data-dir DIR] user USER_ID [--days N]
+"""
+import argparse
+import json
+import mmap
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from samples import Sample, parse_sample_line
+
+DEFAULT_DATA_DIR = Path(__file__).absolute().parent.joinpath("data")
+USER_STATES_FILE_NAME = "user_states.json"
+# As in timeprof_matrix_bot.py, not imported to keep nio out of this tool
+STATE_NAMES = {0: "none", 1: "activity_wait", 2: "room_switch_wait"}
+KEY_STATE = "state"
+KEY_ROOM = "room_id"
+KEY_RATE = "poisson_process_rate"
+KEY_NEXT_SAMPLE_TIME = "next_sample_time"
+KEY_ACCOUNT = "account_id"
+# Older bots write the user states file in place, retry if caught mid-write
+STATE_READ_ATTEMPTS = 5
+STATE_READ_RETRY_S = 0.1
+DEFAULT_GRACE_MINUTES = 5
+TOP_LABELS = 10
+
+
+@contextmanager
+def map_file(path):
+    """Memory map path read-only, yields None for an empty file"""
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            yield None
+            return
+        try:
+            yield mm
+        finally:
+            mm.close()
+
+
+def load_user_states(data_dir):
+    path = Path(data_dir).joinpath(USER_STATES_FILE_NAME)
+    if not path.exists():
+        return {}
+    for attempt in range(STATE_READ_ATTEMPTS):
+        with map_file(path) as mm:
+            data = mm[:] if mm is not None else b""
+        try:
+            user_states = json.loads(data)
+            break
+        except ValueError:
+            if attempt == STATE_READ_ATTEMPTS - 1:
+                raise
+            time.sleep(STATE_READ_RETRY_S)
+    for user_state in user_states.values():
+        next_sample_time = user_state.get(KEY_NEXT_SAMPLE_TIME)
+        if next_sample_time is not None:
+            user_state[KEY_NEXT_SAMPLE_TIME] = datetime.fromisoformat(next_sample_time)
+    return user_states
+
+
+def iter_lines_reversed(mm):
+    """Yield the complete lines of a mapped sample file, last first"""
+    end = mm.rfind(b"\n") + 1
+    while end > 0:
+        start = mm.rfind(b"\n", 0, end - 1) + 1
+        yield mm[start:end].decode()
+        end = start
+
+
+def get_sample_file_path(data_dir, user_id):
+    return Path(data_dir).joinpath("{}.csv".format(user_id))
+
+
+def get_last_record(data_dir, user_id):
+    """Return the last record of the user's sample file or None"""
+    path = get_sample_file_path(data_dir, user_id)
+    if not path.exists():
+        return None
+    with map_file(path) as mm:
+        if mm is None:
+            return None
+        for line in iter_lines_reversed(mm):
+            return parse_sample_line(line)
+    return None
+
+
+def get_record_times(record):
+    """Return (first, last) sample time of a Sample or SampleRange"""
+    if isinstance(record, Sample):
+        return record.time, record.time
+    return record.start, record.end
+
+
+def summarise_samples(data_dir, user_id, since=None):
+    """Counts, time range and label minutes of the user's samples,
+    read from the end back to since (datetime.datetime) if given
+    """
+    summary = {
+        "samples": 0,
+        "answered": 0,
+        "placeholders": {},
+        "first": None,
+        "last": None,
+        "label_minutes": {}
+    }
+    path = get_sample_file_path(data_dir, user_id)
+    if not path.exists():
+        return summary
+    with map_file(path) as mm:
+        if mm is None:
+            return summary
+        for line in iter_lines_reversed(mm):
+            record = parse_sample_line(line)
+            first, last = get_record_times(record)
+            if since is not None and last < since:
+                break
+            if summary["last"] is None:
+                summary["last"] = last
+            summary["first"] = first
+            n = len(record)
+            summary["samples"] += n
+            if record.is_placeholder():
+                placeholders = summary["placeholders"]
+                placeholders[record.label] = placeholders.get(record.label, 0) + n
+            else:
+                summary["answered"] += n
+                label_minutes = summary["label_minutes"]
+                label_minutes[record.label] = label_minutes.get(record.label, 0.0) + n*record.rate
+    return summary
+
+
+def format_time(dt):
+    return dt.isoformat(sep=" ", timespec="seconds") if dt is not None else "-"
+
+
+def list_users(data_dir, state=None):
+    user_states = load_user_states(data_dir)
+    print("{:40s} {:>16s} {:>6s} {:>19s} {:>19s}  {}".format(
+        "user", "state", "rate", "next sample", "last sample", "account"))
+    for user_id in sorted(user_states):
+        user_state = user_states[user_id]
+        state_name = STATE_NAMES.get(user_state.get(KEY_STATE), str(user_state.get(KEY_STATE)))
+        if state is not None and state_name != state:
+            continue
+        last_record = get_last_record(data_dir, user_id)
+        print("{:40s} {:>16s} {:>6} {:>19s} {:>19s}  {}".format(
+            user_id, state_name, user_state.get(KEY_RATE),
+            format_time(user_state.get(KEY_NEXT_SAMPLE_TIME)),
+            format_time(get_record_times(last_record)[1] if last_record is not None else None),
+            user_state.get(KEY_ACCOUNT) or "-"))
+
+
+def list_overdue(data_dir, grace):
+    """Print users whose next sample time passed more than grace
+    (datetime.timedelta) ago, most overdue first
+    """
+    user_states = load_user_states(data_dir)
+    now = datetime.now()
+    overdue = []
+    for user_id, user_state in user_states.items():
+        next_sample_time = user_state.get(KEY_NEXT_SAMPLE_TIME)
+        if next_sample_time is not None and now - next_sample_time > grace:
+            overdue.append((next_sample_time, user_id))
+    for next_sample_time, user_id in sorted(overdue):
+        print("{:40s} due {} ({:.1f} min ago)".format(
+            user_id, format_time(next_sample_time), (now - next_sample_time).total_seconds()/60.0))
+    print("{} of {} users overdue by more than {}".format(len(overdue), len(user_states), grace))
+
+
+def show_user(data_dir, user_id, days=None):
+    user_states = load_user_states(data_dir)
+    user_state = user_states.get(user_id)
+    if user_state is None:
+        print("{} is not registered".format(user_id))
+    else:
+        print("User: {}".format(user_id))
+        print("State: {}".format(STATE_NAMES.get(user_state.get(KEY_STATE), user_state.get(KEY_STATE))))
+        print("Room: {}".format(user_state.get(KEY_ROOM)))
+        print("Account: {}".format(user_state.get(KEY_ACCOUNT) or "-"))
+        print("Rate: {} min".format(user_state.get(KEY_RATE)))
+        print("Next sample: {}".format(format_time(user_state.get(KEY_NEXT_SAMPLE_TIME))))
+
+    since = datetime.now() - timedelta(days=days) if days is not None else None
+    summary = summarise_samples(data_dir, user_id, since)
+    print("Samples{}: {} ({} answered), {} to {}".format(
+        " in the last {} days".format(days) if days is not None else "",
+        summary["samples"], summary["answered"],
+        format_time(summary["first"]), format_time(summary["last"])))
+    for label, count in sorted(summary["placeholders"].items()):
+        print("  {}: {}".format(label, count))
+    label_minutes = summary["label_minutes"]
+    total_minutes = max(sum(label_minutes.values()), 1e-12)
+    for label in sorted(label_minutes, key=label_minutes.get, reverse=True)[:TOP_LABELS]:
+        print("  {:30s} {:8.1f} h {:6.1%}".format(
+            label, label_minutes[label]/60.0, label_minutes[label]/total_minutes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", default=str(DEFAULT_DATA_DIR))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    list_parser = subparsers.add_parser("list", help="list users")
+    list_parser.add_argument("--state", choices=sorted(STATE_NAMES.values()))
+    overdue_parser = subparsers.add_parser("overdue", help="list users whose next sample is overdue")
+    overdue_parser.add_argument("--grace", type=float, default=DEFAULT_GRACE_MINUTES,
+                                help="minutes past the sample time before it counts as overdue")
+    user_parser = subparsers.add_parser("user", help="summarise a user's state and samples")
+    user_parser.add_argument("user_id")
+    user_parser.add_argument("--days", type=float, help="only samples from the last days")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        list_users(args.data_dir, args.state)
+    elif args.command == "overdue":
+        list_overdue(args.data_dir, timedelta(minutes=args.grace))
+    elif args.command == "user":
+        show_user(args.data_dir, args.user_id, args.days)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Logging setup that keeps handler I/O off the event loop.
+
+Records are put on a queue by the logging call and written by a background
+thread. Messages are formatted in that thread when their arguments are
+immutable, and repeats of the same message below WARNING are rate limited.
+"""
+import logging
+import logging.handlers
+import queue
+import time
+from datetime import datetime, timedelta
+
+REPEAT_LIMIT = 10
+REPEAT_INTERVAL_S = 60.0
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Arguments of these types can't change before the listener thread formats them
+_IMMUTABLE_ARG_TYPES = (str, int, float, bool, type(None), datetime, timedelta)
+
+
+class RepeatFilter(logging.Filter):
+    def __init__(self, limit=REPEAT_LIMIT, interval=REPEAT_INTERVAL_S, monotonic=time.monotonic):
+        """Let through at most limit records below WARNING with the same
+        formatted message per interval seconds. How many were dropped is
+        reported by pop_reports once their window is over.
+        """
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.monotonic = monotonic
+        # (name, levelno, message) -> [window start, count, suppressed]
+        self.windows = {}
+        self.expired = []
+        self.last_sweep = monotonic()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = self.monotonic()
+        window = self.windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            if window is not None and window[2]:
+                self.expired.append((key, window[2]))
+            window = self.windows[key] = [now, 0, 0]
+        if window[1] >= self.limit:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
+
+    def pop_reports(self, force=False):
+        """Return records telling how many messages were suppressed in
+        windows that are over, or in all windows if force
+        """
+        now = self.monotonic()
+        if force or now - self.last_sweep >= self.interval:
+            # Also drops finished windows, so distinct messages don't pile up
+            self.last_sweep = now
+            for key, window in list(self.windows.items()):
+                if force or now - window[0] >= self.interval:
+                    del self.windows[key]
+                    if window[2]:
+                        self.expired.append((key, window[2]))
+        reports = []
+        for (name, levelno, message), suppressed in self.expired:
+            reports.append(logging.LogRecord(name, levelno, __file__, 0, "Suppressed %s repeats of: %s",
+                                             (suppressed, message), None))
+        self.expired = []
+        return reports
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, queue, repeat_filter=None):
+        super().__init__(queue)
+        self.repeat_filter = repeat_filter
+        if repeat_filter is not None:
+            self.addFilter(repeat_filter)
+
+    def handle(self, record):
+        self.emit_reports()
+        return super().handle(record)
+
+    def emit_reports(self, force=False):
+        if self.repeat_filter is not None:
+            for report in self.repeat_filter.pop_reports(force):
+                self.emit(report)
+
+    def prepare(self, record):
+        """Leave formatting to the listener thread unless an argument could
+        be mutated before it gets there
+        """
+        args = record.args if record.args is not None else ()
+        if (record.exc_info is None and isinstance(args, tuple) and
+                all(isinstance(arg, _IMMUTABLE_ARG_TYPES) for arg in args)):
+            return record
+        return super().prepare(record)
+
+
+class ReportingQueueListener(logging.handlers.QueueListener):
+    def __init__(self, queue, *handlers, queue_handler, respect_handler_level=False):
+        super().__init__(queue, *handlers, respect_handler_level=respect_handler_level)
+        self.queue_handler = queue_handler
+
+    def stop(self):
+        """Report messages still suppressed, then flush the queue"""
+        self.queue_handler.emit_reports(force=True)
+        super().stop()
+
+
+def setup_logging(level=logging.INFO, handlers=None):
+    """Route all logging through a queue, return the started listener.
+    Call stop() on it at exit to flush the queue.
+    """
+    if handlers is None:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers = [stream_handler]
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue, RepeatFilter())
+    root_logger = logging.getLogger()
+    root_logger.handlers = [queue_handler]
+    root_logger.setLevel(level)
+    listener = ReportingQueueListener(log_queue, *handlers, queue_handler=queue_handler,
+                                      respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,81 @@
+"""Clocks used by the bot for the current time and for sleeping until sample times.
+
+VirtualClock lets simulations and tests run weeks of sampling in seconds by
+jumping straight to the next time something is waiting for.
+"""
+import asyncio
+import heapq
+import itertools
+from datetime import datetime, timedelta
+
+# Event loop iterations to let woken tasks run before the next time jump.
+# Work that takes longer to reach its next sleep just runs late in virtual time.
+SETTLE_YIELDS = 5
+
+
+class Clock():
+    def now(self):
+        return datetime.now()
+
+    async def sleep_until(self, dt):
+        await asyncio.sleep(max(0.0, (dt - self.now()).total_seconds()))
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    def __init__(self, start=None, resolution=timedelta(0), settle_yields=SETTLE_YIELDS):
+        """Create a clock that only moves when advanced from:
+        start -- start time (datetime.datetime), defaults to the current time
+        resolution -- sleepers due within this of the first one are woken
+        together (datetime.timedelta), trading timing accuracy for speed
+        """
+        self.time = start if start is not None else datetime.now()
+        self.resolution = resolution
+        self.settle_yields = settle_yields
+        self.sleepers = []
+        self.counter = itertools.count()
+
+    def now(self):
+        return self.time
+
+    async def sleep_until(self, dt):
+        if dt <= self.time:
+            await asyncio.sleep(0)
+            return
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.sleepers, (dt, next(self.counter), future))
+        await future
+
+    async def sleep(self, seconds):
+        await self.sleep_until(self.time + timedelta(seconds=seconds))
+
+    async def settle(self):
+        for i in range(self.settle_yields):
+            await asyncio.sleep(0)
+
+    async def run_until(self, end):
+        """Advance the time to end (datetime.datetime), waking every sleeper
+        in time order and letting it run before moving on
+        """
+        while True:
+            await self.settle()
+            while self.sleepers and self.sleepers[0][2].done():
+                heapq.heappop(self.sleepers)
+            if not self.sleepers or self.sleepers[0][0] > end:
+                break
+            batch_end = min(self.sleepers[0][0] + self.resolution, end)
+            woken = []
+            while self.sleepers and self.sleepers[0][0] <= batch_end:
+                dt, i, future = heapq.heappop(self.sleepers)
+                self.time = max(self.time, dt)
+                woken.append(future)
+            for future in woken:
+                if not future.done():
+                    future.set_result(None)
+        self.time = max(self.time, end)
+
+    def get_next_wakeup(self):
+        pending = [dt for dt, i, future in self.sleepers if not future.done()]
+        return min(pending) if pending else None
@@ -0,0 +1,132 @@
+"""Outbound message queue.
+
+Messages are queued per room and sent by one task per room, so sends to
+different rooms run concurrently over the client's HTTP connection pool
+while each room keeps its order. Text messages queued back to back for a
+room are joined into one event. Rate-limited sends are retried with backoff.
+"""
+import asyncio
+import collections
+import logging
+import time
+
+from nio import RoomSendError
+
+MAX_SEND_ATTEMPTS = 5
+RETRY_BACKOFF_S = 1.0
+MAX_COALESCED_LENGTH = 4000
+LIMIT_EXCEEDED = "M_LIMIT_EXCEEDED"
+
+
+class OutboxStats():
+    def __init__(self):
+        self.n_queued = 0
+        self.n_events = 0
+        self.n_coalesced = 0
+        self.n_retries = 0
+        self.n_failed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def add_sent(self, n_messages, latencies):
+        self.n_events += 1
+        self.n_coalesced += n_messages - 1
+        self.total_latency += sum(latencies)
+        self.max_latency = max([self.max_latency] + latencies)
+
+    def __str__(self):
+        n_messages = max(self.n_events + self.n_coalesced, 1)
+        return "{} events for {} messages, {} retries, {} failed, mean latency {:.3f} s (max {:.3f} s)".format(
+            self.n_events, self.n_events + self.n_coalesced, self.n_retries, self.n_failed,
+            self.total_latency/n_messages, self.max_latency)
+
+
+class Outbox():
+    def __init__(self, send_func, clock):
+        """Create outbox from:
+        send_func -- coroutine function (room_id, content) returning a nio response
+        clock -- clock used for retry delays (clock.Clock)
+        """
+        self.send_func = send_func
+        self.clock = clock
+        self.queues = {}
+        self.senders = {}
+        self.stats = OutboxStats()
+
+    def get_queue_depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def put(self, room_id, content):
+        """Queue a message event content for room_id.
+        Returns a future with the send response.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        queue = self.queues.setdefault(room_id, collections.deque())
+        queue.append((content, future, time.perf_counter()))
+        self.stats.n_queued += 1
+        if room_id not in self.senders:
+            self.senders[room_id] = loop.create_task(self.run_room(room_id))
+        return future
+
+    def take_batch(self, queue):
+        """Pop the next message, joined with the text messages right after it"""
+        batch = [queue.popleft()]
+        content = batch[0][0]
+        if content.get("msgtype") != "m.text":
+            return content, batch
+        bodies = [content["body"]]
+        length = len(content["body"])
+        while queue and queue[0][0].get("msgtype") == "m.text":
+            body = queue[0][0]["body"]
+            if length + len(body) + 1 > MAX_COALESCED_LENGTH:
+                break
+            batch.append(queue.popleft())
+            bodies.append(body)
+            length += len(body) + 1
+        if len(batch) > 1:
+            content = dict(content, body="\n".join(bodies))
+        return content, batch
+
+    async def send_with_retry(self, room_id, content):
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            resp = await self.send_func(room_id, content)
+            if not (isinstance(resp, RoomSendError) and resp.status_code == LIMIT_EXCEEDED):
+                return resp
+            self.stats.n_retries += 1
+            delay = RETRY_BACKOFF_S*2**attempt
+            if resp.retry_after_ms:
+                delay = max(delay, resp.retry_after_ms*1e-3)
+            logging.info("Rate limited sending to %s, retrying in %.1f s", room_id, delay)
+            await self.clock.sleep(delay)
+        return resp
+
+    async def run_room(self, room_id):
+        queue = self.queues[room_id]
+        try:
+            while queue:
+                content, batch = self.take_batch(queue)
+                try:
+                    resp = await self.send_with_retry(room_id, content)
+                except Exception as e:
+                    logging.exception("Failed to send to %s", room_id)
+                    resp = e
+                if isinstance(resp, (RoomSendError, Exception)):
+                    self.stats.n_failed += len(batch)
+                    logging.warning("Failed to send to %s: %s", room_id, resp)
+                else:
+                    now = time.perf_counter()
+                    self.stats.add_sent(len(batch), [now - queued for _, _, queued in batch])
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_result(resp)
+        finally:
+            for _, future, _ in queue:
+                future.cancel()
+            del self.queues[room_id]
+            del self.senders[room_id]
+
+    async def flush(self):
+        """Wait until every queued message is sent"""
+        while self.senders:
+            await asyncio.gather(*self.senders.values(), return_exceptions=True)
@@ -0,0 +1,59 @@
+"""Activity plots of a user's samples.
+
+Rendering runs in worker processes, see render_activity_plot.
+"""
+import numpy as np
+
+from samples import iter_samples
+
+PLOT_MAX_LABELS = 15
+PLOT_DPI = 100
+
+
+def get_activity_tables(sample_path):
+    """Return (labels, minutes per label, 7x24 weekday by hour sample counts)
+    for the answered samples in sample_path
+    """
+    minutes = {}
+    heatmap = np.zeros((7, 24))
+    for sample in iter_samples(sample_path):
+        if sample.is_placeholder():
+            continue
+        minutes[sample.label] = minutes.get(sample.label, 0.0) + sample.rate
+        heatmap[sample.time.weekday(), sample.time.hour] += 1
+    labels = sorted(minutes, key=minutes.get, reverse=True)
+    return labels, [minutes[label] for label in labels], heatmap
+
+
+def render_activity_plot(sample_path, image_path):
+    """Render a time share chart and a weekday/hour heatmap to image_path (PNG)"""
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    labels, minutes, heatmap = get_activity_tables(sample_path)
+    if len(labels) > PLOT_MAX_LABELS:
+        other = sum(minutes[PLOT_MAX_LABELS - 1:])
+        labels = labels[:PLOT_MAX_LABELS - 1] + ["(other)"]
+        minutes = minutes[:PLOT_MAX_LABELS - 1] + [other]
+    total = max(sum(minutes), 1e-12)
+
+    fig, (ax_share, ax_heatmap) = plt.subplots(1, 2, figsize=(12, 5))
+    y = np.arange(len(labels))
+    ax_share.barh(y, [100*m/total for m in minutes])
+    ax_share.set_yticks(y)
+    ax_share.set_yticklabels(labels)
+    ax_share.invert_yaxis()
+    ax_share.set_xlabel("time share (%)")
+
+    image = ax_heatmap.imshow(heatmap, aspect="auto", cmap="viridis")
+    ax_heatmap.set_yticks(range(7))
+    ax_heatmap.set_yticklabels(["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"])
+    ax_heatmap.set_xlabel("hour of day")
+    ax_heatmap.set_title("answered samples")
+    fig.colorbar(image, ax=ax_heatmap)
+
+    fig.tight_layout()
+    fig.savefig(image_path, dpi=PLOT_DPI)
+    plt.close(fig)
+    return image_path
@@ -0,0 +1,162 @@
+"""Population statistics over the sample files of all users.
+
+Every user's sample file is mapped, in a process pool, to a partial
+aggregate of counts and weighted times. Partials are merged into population
+tables. They are cached per file, so a re-run only scans files that changed
+since the last run.
+
+Usage: population.py [data_dir] [--output tables.json] [--workers N]
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from samples import BOT_OFF_LABEL, UNANSWERED_LABEL, iter_records
+
+DEFAULT_DATA_DIR = Path(__file__).absolute().parent.joinpath("data")
+CACHE_FILE_NAME = "population_cache.json"
+
+
+def empty_partial():
+    return {
+        "n_users": 0,
+        "n_samples": 0,
+        "n_placeholders": 0,
+        "n_unanswered": 0,
+        "n_bot_off": 0,
+        "label_counts": {},
+        # Each sample stands for on average poisson_process_rate minutes
+        "label_minutes": {},
+        # Number of users that used each word
+        "word_users": {}
+    }
+
+
+def map_sample_file(path):
+    """Partial aggregate of one user's sample file"""
+    partial = empty_partial()
+    partial["n_users"] = 1
+    words = set()
+    for record in iter_records(path):
+        n = len(record)
+        partial["n_samples"] += n
+        if record.is_placeholder():
+            partial["n_placeholders"] += n
+            if record.label == UNANSWERED_LABEL:
+                partial["n_unanswered"] += n
+            elif record.label == BOT_OFF_LABEL:
+                partial["n_bot_off"] += n
+            continue
+        label_counts = partial["label_counts"]
+        label_counts[record.label] = label_counts.get(record.label, 0) + n
+        label_minutes = partial["label_minutes"]
+        label_minutes[record.label] = label_minutes.get(record.label, 0.0) + n*record.rate
+        words.update(record.label.lower().split())
+    partial["word_users"] = {word: 1 for word in words}
+    return partial
+
+
+def merge_partials(total, partial):
+    """Add partial into total, both from map_sample_file or merge_partials"""
+    for key, value in partial.items():
+        if isinstance(value, dict):
+            counts = total[key]
+            for name, count in value.items():
+                counts[name] = counts.get(name, 0) + count
+        else:
+            total[key] += value
+    return total
+
+
+def build_tables(total):
+    n_answered = total["n_samples"] - total["n_placeholders"]
+    n_asked = n_answered + total["n_unanswered"]
+    total_minutes = sum(total["label_minutes"].values())
+    labels = sorted(total["label_counts"], key=total["label_counts"].get, reverse=True)
+    label_table = []
+    for label in labels:
+        label_table.append({
+            "label": label,
+            "samples": total["label_counts"][label],
+            "sample_share": total["label_counts"][label]/max(n_answered, 1),
+            "hours": total["label_minutes"][label]/60.0,
+            "time_share": total["label_minutes"][label]/max(total_minutes, 1e-12)
+        })
+    words = sorted(total["word_users"], key=total["word_users"].get, reverse=True)
+    return {
+        "users": total["n_users"],
+        "samples": total["n_samples"],
+        "response_rate": n_answered/max(n_asked, 1),
+        "placeholder_ratio": total["n_placeholders"]/max(total["n_samples"], 1),
+        "bot_off_ratio": total["n_bot_off"]/max(total["n_samples"], 1),
+        "labels": label_table,
+        "vocabulary": [{"word": word, "users": total["word_users"][word]} for word in words]
+    }
+
+
+def get_file_key(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def load_cache(cache_path):
+    if cache_path.exists():
+        with open(cache_path, 'r') as fp:
+            return json.load(fp)
+    return {}
+
+
+def run(data_dir, n_workers=None, use_cache=True):
+    """Return (population tables, number of files scanned)"""
+    data_dir = Path(data_dir)
+    cache_path = data_dir.joinpath(CACHE_FILE_NAME)
+    cache = load_cache(cache_path) if use_cache else {}
+
+    paths = sorted(data_dir.glob("*.csv"))
+    file_keys = {path.name: get_file_key(path) for path in paths}
+    changed = [path for path in paths
+               if cache.get(path.name, {}).get("key") != file_keys[path.name]]
+
+    if changed:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            partials = executor.map(map_sample_file, changed, chunksize=16)
+            for path, partial in zip(changed, partials):
+                cache[path.name] = {"key": file_keys[path.name], "partial": partial}
+
+    # Forget users whose files are gone
+    cache = {name: entry for name, entry in cache.items() if name in file_keys}
+    if use_cache:
+        with open(cache_path, 'w') as fp:
+            json.dump(cache, fp)
+
+    total = empty_partial()
+    for entry in cache.values():
+        merge_partials(total, entry["partial"])
+    return build_tables(total), len(changed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("data_dir", nargs="?", default=str(DEFAULT_DATA_DIR))
+    parser.add_argument("--output", help="write tables as JSON to this file")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-cache", action="store_true", help="scan every file")
+    args = parser.parse_args()
+
+    tables, n_scanned = run(args.data_dir, args.workers, not args.no_cache)
+    print("Scanned {} changed files".format(n_scanned))
+    print("Users: {}, samples: {}".format(tables["users"], tables["samples"]))
+    print("Response rate: {:.1%}, placeholder ratio: {:.1%}, bot off ratio: {:.1%}".format(
+        tables["response_rate"], tables["placeholder_ratio"], tables["bot_off_ratio"]))
+    for row in tables["labels"]:
+        print("{:30s} {:8d} samples {:7.1%} {:10.1f} h {:7.1%}".format(
+            row["label"], row["samples"], row["sample_share"], row["hours"], row["time_share"]))
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(tables, fp, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Token buckets limiting how much inbound input the bot handles.
+
+Every user has a bucket and all users share a global one. Input beyond the
+limits is dropped and counted. Error replies to invalid input are limited to
+one per interval per user, and the next one says how many were held back.
+"""
+from datetime import timedelta
+
+USER_MESSAGES_PER_S = 1.0
+USER_MESSAGE_BURST = 10
+GLOBAL_MESSAGES_PER_S = 50.0
+GLOBAL_MESSAGE_BURST = 200
+MAX_USER_QUEUE_DEPTH = 20
+ERROR_REPLY_INTERVAL = timedelta(seconds=30)
+
+
+class TokenBucket():
+    def __init__(self, rate, capacity, now):
+        """Create a full bucket from:
+        rate -- tokens added per second (float)
+        capacity -- maximum number of tokens (int)
+        now -- current time (datetime.datetime)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def take(self, now, tokens=1):
+        elapsed = max(0.0, (now - self.updated).total_seconds())
+        self.tokens = min(self.capacity, self.tokens + elapsed*self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+
+class InboundLimiter():
+    def __init__(self, clock,
+                 user_rate=USER_MESSAGES_PER_S, user_burst=USER_MESSAGE_BURST,
+                 global_rate=GLOBAL_MESSAGES_PER_S, global_burst=GLOBAL_MESSAGE_BURST,
+                 error_reply_interval=ERROR_REPLY_INTERVAL):
+        self.clock = clock
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst, clock.now())
+        self.user_buckets = {}
+        self.error_reply_interval = error_reply_interval
+        # user_id -> (time of last error reply, errors not replied to since)
+        self.error_replies = {}
+        self.dropped = {
+            "user_rate": 0,
+            "global_rate": 0,
+            "queue_full": 0,
+            "error_replies": 0
+        }
+
+    def allow(self, user_id, queue_depth=0):
+        """Return True if a message from user_id should be handled"""
+        now = self.clock.now()
+        if queue_depth >= MAX_USER_QUEUE_DEPTH:
+            self.dropped["queue_full"] += 1
+            return False
+        bucket = self.user_buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst, now)
+            self.user_buckets[user_id] = bucket
+        if not bucket.take(now):
+            self.dropped["user_rate"] += 1
+            return False
+        if not self.global_bucket.take(now):
+            self.dropped["global_rate"] += 1
+            return False
+        return True
+
+    def take_error_reply(self, user_id):
+        """Return None if no error reply should be sent to user_id now,
+        otherwise the number of earlier errors that weren't replied to
+        """
+        now = self.clock.now()
+        last_reply, n_held = self.error_replies.get(user_id, (None, 0))
+        if last_reply is not None and now - last_reply < self.error_reply_interval:
+            self.error_replies[user_id] = (last_reply, n_held + 1)
+            self.dropped["error_replies"] += 1
+            return None
+        self.error_replies[user_id] = (now, 0)
+        return n_held
+
+    def remove_user(self, user_id):
+        self.user_buckets.pop(user_id, None)
+        self.error_replies.pop(user_id, None)
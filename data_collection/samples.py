@@ -0,0 +1,214 @@
+"""Reading and writing the per-user sample files saved by the bot.
+
+Every line is either a sample, "<timestamp>, <label>, <poisson_process_rate>",
+or a run of placeholder samples with the same label and rate,
+"~<first timestamp>, <last timestamp>, <count>, <label>, <poisson_process_rate>".
+Runs are expanded to individual samples when read.
+
+Files are only appended to while the bot runs, one record per write. Run as a
+script to merge consecutive placeholder records into runs. This rewrites the
+files, so it refuses to run while the bot holds the lock of their directory.
+
+Usage: samples.py SAMPLE_FILE...
+"""
+import fcntl
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+SAMPLE_SEPARATOR = ", "
+RANGE_PREFIX = "~"
+# Labels of pings that got no answer, and of pings missed while the bot was off
+UNANSWERED_LABEL = "EMPTY"
+BOT_OFF_LABEL = "EMPTY (BOT OFF)"
+PLACEHOLDER_LABELS = (UNANSWERED_LABEL, BOT_OFF_LABEL)
+# Held by the process writing the sample files of a directory
+LOCK_FILE_NAME = "samples.lock"
+
+
+class Sample():
+    def __init__(self, time, label, rate):
+        self.time = time
+        self.label = label
+        self.rate = rate
+
+    def __len__(self):
+        return 1
+
+    def is_placeholder(self):
+        return self.label in PLACEHOLDER_LABELS
+
+    def expand(self):
+        yield self
+
+
+class SampleRange():
+    def __init__(self, start, end, count, label, rate):
+        """Run of count placeholder samples from start to end (datetimes)"""
+        self.start = start
+        self.end = end
+        self.count = count
+        self.label = label
+        self.rate = rate
+
+    def __len__(self):
+        return self.count
+
+    def is_placeholder(self):
+        return True
+
+    def expand(self):
+        """Yield the samples of the run.
+
+        Only the first and last sample times are stored, the ones in between
+        are spread evenly. Placeholders carry no activity, so only their
+        number matters for time shares.
+        """
+        if self.count == 1:
+            yield Sample(self.start, self.label, self.rate)
+            return
+        step = (self.end - self.start)/(self.count - 1)
+        for i in range(self.count - 1):
+            yield Sample(self.start + i*step, self.label, self.rate)
+        yield Sample(self.end, self.label, self.rate)
+
+
+def format_sample_line(sample_time, label, rate):
+    return "{}{}{}{}{}\n".format(sample_time, SAMPLE_SEPARATOR, label, SAMPLE_SEPARATOR, rate)
+
+
+def format_range_line(start, end, count, label, rate):
+    fields = [start, end, count, label, rate]
+    return RANGE_PREFIX + SAMPLE_SEPARATOR.join(str(field) for field in fields) + "\n"
+
+
+def format_record_line(record):
+    if len(record) == 1:
+        return format_sample_line(record.start if isinstance(record, SampleRange) else record.time,
+                                  record.label, record.rate)
+    return format_range_line(record.start, record.end, record.count, record.label, record.rate)
+
+
+def parse_sample_line(line):
+    """Parse a line into a Sample or, for placeholder runs, a SampleRange"""
+    line = line.rstrip("\n")
+    if line.startswith(RANGE_PREFIX):
+        start, end, count, rest = line[len(RANGE_PREFIX):].split(SAMPLE_SEPARATOR, 3)
+        label, rate = rest.rsplit(SAMPLE_SEPARATOR, 1)
+        return SampleRange(datetime.fromisoformat(start), datetime.fromisoformat(end),
+                           int(count), label, float(rate))
+    timestamp, rest = line.split(SAMPLE_SEPARATOR, 1)
+    label, rate = rest.rsplit(SAMPLE_SEPARATOR, 1)
+    return Sample(datetime.fromisoformat(timestamp), label, float(rate))
+
+
+def iter_sample_lines(path, offset=0):
+    """Yield (offset, line) for every complete line from byte offset.
+
+    A trailing line without newline is still being written and is skipped.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for raw_line in f:
+            if not raw_line.endswith(b"\n"):
+                break
+            yield offset, raw_line.decode()
+            offset += len(raw_line)
+
+
+def iter_records(path):
+    """Yield Samples and unexpanded SampleRanges in file order"""
+    for offset, line in iter_sample_lines(path):
+        yield parse_sample_line(line)
+
+
+def iter_samples(path):
+    for record in iter_records(path):
+        yield from record.expand()
+
+
+def append_placeholders(path, sample_times, label, rate):
+    """Append placeholder samples as one record, a run if there are
+    several, and return the line written.
+
+    Sample files are only ever appended to, so a reader never sees a line
+    change. Runs written one after another are merged by compact_sample_file.
+    """
+    if len(sample_times) == 1:
+        line = format_sample_line(sample_times[0], label, rate)
+    else:
+        line = format_range_line(sample_times[0], sample_times[-1], len(sample_times), label, rate)
+    with open(path, 'a') as f:
+        f.write(line)
+    return line
+
+
+@contextmanager
+def lock_sample_files(data_dir):
+    """Hold the lock on the sample files in data_dir. Raises RuntimeError
+    if another process holds it.
+    """
+    lock_path = Path(data_dir).joinpath(LOCK_FILE_NAME)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError("Sample files in {} are in use by another process".format(data_dir))
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def compact_sample_file(path):
+    """Rewrite path with consecutive placeholder samples merged into runs.
+
+    Lines appended while the file is rewritten are lost and the bot's word
+    index would no longer match the file, so only call this while holding
+    lock_sample_files, as main does.
+    """
+    records = []
+    for record in iter_records(path):
+        last = records[-1] if records else None
+        if (last is not None and last.is_placeholder() and record.is_placeholder() and
+                last.label == record.label and last.rate == record.rate):
+            first = last.start if isinstance(last, SampleRange) else last.time
+            last_time = record.end if isinstance(record, SampleRange) else record.time
+            records[-1] = SampleRange(first, last_time, len(last) + len(record), last.label, last.rate)
+        else:
+            records.append(record)
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, 'w') as f:
+        for record in records:
+            f.write(format_record_line(record))
+    os.replace(tmp_path, path)
+
+
+def compact_sample_files(paths):
+    """Compact the sample files at paths. Their word indexes are removed and
+    get rebuilt on next use.
+    """
+    from activity_index import get_index_path
+    for data_dir in sorted({Path(path).absolute().parent for path in paths}):
+        with lock_sample_files(data_dir):
+            for path in paths:
+                if Path(path).absolute().parent != data_dir:
+                    continue
+                compact_sample_file(path)
+                index_path = get_index_path(path)
+                if index_path.exists():
+                    os.remove(index_path)
+
+
+def main():
+    try:
+        compact_sample_files(sys.argv[1:])
+    except RuntimeError as e:
+        sys.exit("{}, stop the bot first".format(e))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""Checks that the stored samples of each user look like a Poisson process.
+
+Intervals between consecutive pings, divided by the rate they were drawn
+with, should be exponentially distributed with mean 1. Only some sample
+times are ping times though:
+- placeholders of a bot that was off are saved at their ping time,
+- answers are saved when they arrive, a lag after the ping,
+- an unanswered ping is saved as EMPTY at the time of the next ping.
+
+So the interval from an EMPTY sample to the answer after it is the reply lag
+of that answer, and the interval to an EMPTY sample from anything but another
+EMPTY sample spans two pings and is left out. Since intervals are
+memoryless, an interval ending at an answer is an exponential interval plus
+that answer's reply lag. The test is therefore done on the excess over
+TAIL_START of the intervals longer than it, which is exponential with mean
+1 as long as reply lags are shorter than TAIL_START.
+
+Per user this reports a Kolmogorov-Smirnov test of the excesses against the
+unit exponential, their mean and coefficient of variation, clustering (the
+share of very short intervals relative to the share expected without lag,
+so below 1 for a healthy bot) and the mean reply lag. Intervals inside
+placeholder runs are spread evenly in the file and are left out.
+
+The reply lag is the time from a ping to its answer, so mostly how long
+users take to reply. Any delay of the scheduler in sending the ping is part
+of it, but can't be told apart: only answer times are stored, not the times
+pings were sent.
+
+Files are read in a process pool and the statistics of all users are
+computed together on the concatenated intervals.
+
+Usage: sampling_diagnostics.py [data_dir] [--output diagnostics.json] [--workers N]
+"""
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from samples import UNANSWERED_LABEL, Sample, iter_records
+
+DEFAULT_DATA_DIR = Path(__file__).absolute().parent.joinpath("data")
+# Normalised intervals below this count as clustered
+CLUSTER_THRESHOLD = 0.05
+# Normalised interval length from which excesses are tested
+TAIL_START = 0.5
+MIN_INTERVALS = 10
+ALPHA = 0.01
+KOLMOGOROV_TERMS = 100
+
+# Sample times
+ANSWERED = 0
+UNANSWERED = 1
+SCHEDULED = 2
+# Kinds of intervals
+SKIPPED = 0
+EXACT = 1
+LAGGED = 2
+REPLY_LAG = 3
+
+
+def classify_intervals(points, inside_run):
+    """Return the kind of the interval to each point after the first from
+    the kinds of sample times (array) and whether a point is the second
+    point of a placeholder run (array)
+    """
+    previous = points[:-1]
+    current = points[1:]
+    kinds = np.full(len(current), SKIPPED)
+    kinds[(current == SCHEDULED) | ((current == UNANSWERED) & (previous == UNANSWERED))] = EXACT
+    kinds[(current == ANSWERED) & (previous != UNANSWERED)] = LAGGED
+    kinds[(current == ANSWERED) & (previous == UNANSWERED)] = REPLY_LAG
+    kinds[inside_run[1:]] = SKIPPED
+    return kinds
+
+
+def get_intervals(path):
+    """Return arrays of (interval in minutes, rate in minutes, interval kind)
+    of the consecutive samples in path
+    """
+    times = []
+    rates = []
+    points = []
+    inside_run = []
+    for record in iter_records(path):
+        if record.label == UNANSWERED_LABEL:
+            point = UNANSWERED
+        elif record.is_placeholder():
+            point = SCHEDULED
+        else:
+            point = ANSWERED
+        if isinstance(record, Sample):
+            times.append(record.time.timestamp())
+            rates.append(record.rate)
+            points.append(point)
+            inside_run.append(False)
+            continue
+        times.append(record.start.timestamp())
+        rates.append(record.rate)
+        points.append(point)
+        inside_run.append(False)
+        if record.count > 1:
+            times.append(record.end.timestamp())
+            rates.append(record.rate)
+            points.append(point)
+            inside_run.append(True)
+    intervals = np.diff(np.array(times))/60.0
+    # The next sample is drawn with the rate at the previous one
+    interval_rates = np.array(rates[:-1])
+    kinds = classify_intervals(np.array(points), np.array(inside_run, dtype=bool))
+    is_used = kinds != SKIPPED
+    return intervals[is_used], interval_rates[is_used], kinds[is_used]
+
+
+def kolmogorov_sf(d, n):
+    """Asymptotic p-values of Kolmogorov-Smirnov statistics d from n samples
+    (arrays), with Stephens' small sample correction
+    """
+    sqrt_n = np.sqrt(n)
+    x = (sqrt_n + 0.12 + 0.11/sqrt_n)*d
+    k = np.arange(1, KOLMOGOROV_TERMS + 1)[:, None]
+    terms = 2*(-1.0)**(k - 1)*np.exp(-2*k**2*x[None, :]**2)
+    return np.clip(terms.sum(axis=0), 0.0, 1.0)
+
+
+def ks_statistics(u, user_ids, counts):
+    """Kolmogorov-Smirnov statistics of u against the unit exponential per
+    user, for user_ids sorted in ascending order and counts > 0
+    """
+    order = np.lexsort((u, user_ids))
+    u_sorted = u[order]
+    users_sorted = user_ids[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    n = counts[users_sorted]
+    rank = np.arange(len(u)) - starts[users_sorted] + 1
+    cdf = 1.0 - np.exp(-u_sorted)
+    distance = np.maximum(rank/n - cdf, cdf - (rank - 1)/n)
+    return np.maximum.reduceat(distance, starts)
+
+
+def diagnose(intervals, rates, kinds, user_ids, n_users):
+    """Return a dict of per-user arrays for the concatenated intervals of
+    n_users users, user_ids giving the user of each interval
+    """
+    def per_user(weights, mask):
+        return np.bincount(user_ids[mask], weights[mask], n_users)
+
+    is_interval = kinds != REPLY_LAG
+    counts = np.bincount(user_ids[is_interval], minlength=n_users)
+    u = intervals/rates
+    expected_share = 1.0 - np.exp(-CLUSTER_THRESHOLD)
+    short_share = per_user((u < CLUSTER_THRESHOLD).astype(float), is_interval)/np.maximum(counts, 1)
+    clustering = short_share/expected_share
+
+    is_tail = is_interval & (u > TAIL_START)
+    excess = u - TAIL_START
+    tail_counts = np.bincount(user_ids[is_tail], minlength=n_users)
+    safe_tail_counts = np.maximum(tail_counts, 1)
+    mean = per_user(excess, is_tail)/safe_tail_counts
+    mean_square = per_user(excess**2, is_tail)/safe_tail_counts
+    cv = np.sqrt(np.maximum(mean_square - mean**2, 0.0))/np.maximum(mean, 1e-12)
+
+    is_lag = kinds == REPLY_LAG
+    lag_counts = np.bincount(user_ids[is_lag], minlength=n_users)
+    safe_lag_counts = np.maximum(lag_counts, 1)
+    lag = per_user(intervals, is_lag)/safe_lag_counts
+    lag_square = per_user(intervals**2, is_lag)/safe_lag_counts
+    lag_se = np.sqrt(np.maximum(lag_square - lag**2, 0.0)/safe_lag_counts)
+    lag[lag_counts == 0] = np.nan
+    lag_se[lag_counts == 0] = np.nan
+
+    ks = np.full(n_users, np.nan)
+    p_value = np.full(n_users, np.nan)
+    has_data = tail_counts > 0
+    if has_data.any():
+        # Renumber so users without intervals don't leave empty segments
+        new_ids = np.cumsum(has_data) - 1
+        ks[has_data] = ks_statistics(excess[is_tail], new_ids[user_ids[is_tail]], tail_counts[has_data])
+        p_value[has_data] = kolmogorov_sf(ks[has_data], tail_counts[has_data])
+    mean[~has_data] = np.nan
+    cv[~has_data] = np.nan
+    return {
+        "intervals": counts,
+        "mean": mean,
+        "cv": cv,
+        "clustering": clustering,
+        "reply_lag_minutes": lag,
+        "reply_lag_se_minutes": lag_se,
+        "ks": ks,
+        "p_value": p_value
+    }
+
+
+def run(data_dir, n_workers=None):
+    """Return a list of per-user diagnostics and the pooled diagnostics"""
+    paths = sorted(Path(data_dir).glob("*.csv"))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        per_file = list(executor.map(get_intervals, paths, chunksize=16))
+    n_users = len(paths)
+    if n_users == 0:
+        return [], None
+    user_ids = np.concatenate([np.full(len(intervals), i, dtype=int) for i, (intervals, _, _) in enumerate(per_file)])
+    intervals, rates, kinds = (np.concatenate(arrays) for arrays in zip(*per_file))
+
+    results = diagnose(intervals, rates, kinds, user_ids, n_users)
+    users = []
+    for i, path in enumerate(paths):
+        row = {name: float(values[i]) for name, values in results.items()}
+        row["user"] = path.stem
+        row["intervals"] = int(row["intervals"])
+        users.append(row)
+    pooled = diagnose(intervals, rates, kinds, np.zeros(len(intervals), dtype=int), 1)
+    pooled = {name: float(values[0]) for name, values in pooled.items()}
+    pooled["intervals"] = int(pooled["intervals"])
+    return users, pooled
+
+
+def format_row(name, row):
+    return "{:40s} {:8d} {:6.3f} {:6.3f} {:6.2f} {:7.2f} +-{:5.2f} {:6.3f} {:8.2g}{}".format(
+        name, row["intervals"], row["mean"], row["cv"], row["clustering"],
+        row["reply_lag_minutes"], row["reply_lag_se_minutes"], row["ks"], row["p_value"],
+        " *" if row["p_value"] < ALPHA else "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("data_dir", nargs="?", default=str(DEFAULT_DATA_DIR))
+    parser.add_argument("--output", help="write diagnostics as JSON to this file")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--min-intervals", type=int, default=MIN_INTERVALS,
+                        help="leave out users with fewer intervals from the table")
+    args = parser.parse_args()
+
+    users, pooled = run(args.data_dir, args.workers)
+    if pooled is None:
+        print("No sample files in {}".format(args.data_dir))
+        return
+    print("{:40s} {:>8s} {:>6s} {:>6s} {:>6s} {:>15s} {:>6s} {:>8s}".format(
+        "user", "n", "mean", "cv", "clust", "reply lag (min)", "ks", "p"))
+    shown = [row for row in users if row["intervals"] >= args.min_intervals]
+    for row in sorted(shown, key=lambda row: row["p_value"]):
+        print(format_row(row["user"], row))
+    print(format_row("(all users)", pooled))
+    n_rejected = sum(row["p_value"] < ALPHA for row in shown)
+    print("{} of {} users not exponential at p < {}".format(n_rejected, len(shown), ALPHA))
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({"users": users, "pooled": pooled}, fp, indent=4)
+
+
+if __name__ == '__main__':
+    main()
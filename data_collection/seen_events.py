@@ -0,0 +1,86 @@
+"""Event IDs the bot has already handled, per room.
+
+Syncs can hand the bot the same events again, e.g. after a restart from an
+older sync token. Callbacks check events here first so a replay doesn't save
+a sample twice or re-run joins. Only the most recently seen events of each
+room are kept, and the set is saved after every sync that added to it.
+Events without an ID are only kept in memory until the bot leaves the room,
+since an invite to a room left earlier looks the same as the first one.
+"""
+import collections
+import json
+import os
+
+MAX_EVENTS_PER_ROOM = 200
+EVENT_ID_PREFIX = "$"
+
+
+def get_event_key(event):
+    """Event ID, or a key built from the content of events stripped of
+    their ID, like the member events of invites
+    """
+    event_id = event.source.get("event_id")
+    if event_id is not None:
+        return event_id
+    return "{}|{}|{}|{}".format(
+        event.source.get("type"), event.source.get("sender"),
+        event.source.get("state_key"), event.source.get("content", {}).get("membership"))
+
+
+class SeenEvents():
+    def __init__(self, max_per_room=MAX_EVENTS_PER_ROOM):
+        self.max_per_room = max_per_room
+        # room_id -> OrderedDict of event keys, least recently seen first
+        self.rooms = {}
+        self.changed = False
+
+    def __len__(self):
+        return sum(len(events) for events in self.rooms.values())
+
+    def is_replay(self, room_id, event):
+        """Return True if event was seen in room_id before, otherwise
+        remember it and return False
+        """
+        key = get_event_key(event)
+        events = self.rooms.setdefault(room_id, collections.OrderedDict())
+        if key in events:
+            events.move_to_end(key)
+            return True
+        events[key] = None
+        if len(events) > self.max_per_room:
+            events.popitem(last=False)
+        self.changed = True
+        return False
+
+    def remove_room(self, room_id):
+        if self.rooms.pop(room_id, None) is not None:
+            self.changed = True
+
+    def to_dict(self):
+        """Event IDs per room, without the keys of events without an ID"""
+        return {room_id: [key for key in events if key.startswith(EVENT_ID_PREFIX)]
+                for room_id, events in self.rooms.items()}
+
+    @classmethod
+    def from_dict(cls, rooms_dict, max_per_room=MAX_EVENTS_PER_ROOM):
+        seen_events = cls(max_per_room)
+        for room_id, keys in rooms_dict.items():
+            seen_events.rooms[room_id] = collections.OrderedDict.fromkeys(keys[-max_per_room:])
+        return seen_events
+
+    def save(self, path):
+        """Save to path if anything changed since the last save"""
+        if not self.changed:
+            return
+        tmp_path = "{}.tmp".format(path)
+        with open(tmp_path, 'w') as fp:
+            json.dump(self.to_dict(), fp)
+        os.replace(tmp_path, path)
+        self.changed = False
+
+    @classmethod
+    def load(cls, path, max_per_room=MAX_EVENTS_PER_ROOM):
+        if not os.path.exists(path):
+            return cls(max_per_room)
+        with open(path, 'r') as fp:
+            return cls.from_dict(json.load(fp), max_per_room)
@@ -0,0 +1,103 @@
+"""End-to-end simulation of the bot on a virtual clock.
+
+Simulated users answer pings with random activities after a random delay.
+Nothing is sent to a homeserver, and weeks of sampling for thousands of users
+run in seconds.
+
+Usage: simulation.py [n_users] [days]
+"""
+import asyncio
+import logging
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from nio import RoomSendResponse
+
+from clock import VirtualClock
+from timeprof_matrix_bot import (
+    TimeProfBot,
+    DataBase,
+    KEY_ROOM,
+    STATE_ACTIVITY_WAIT
+)
+
+SIM_HOMESERVER = "http://localhost:8008"
+SIM_BOT_ID = "@sim_bot:localhost"
+SIM_ACTIVITIES = ["work", "food", "sleep", "play", "commute"]
+SIM_CLOCK_RESOLUTION = timedelta(minutes=1)
+
+
+class SimulatedBot(TimeProfBot):
+    def __init__(self, clock, data_dir, reply_probability=0.9, mean_reply_delay=5.0):
+        """Create a bot that records outgoing messages instead of sending them.
+
+        reply_probability -- chance that a simulated user answers a ping (float)
+        mean_reply_delay -- mean reply delay in minutes (float)
+        """
+        super().__init__(SIM_HOMESERVER, SIM_BOT_ID, "", clock=clock)
+        self.database = DataBase(data_dir, autosave=False)
+        self.add_commands()
+        self.reply_probability = reply_probability
+        self.mean_reply_delay = mean_reply_delay
+        self.sent_messages = []
+        self.room_users = {}
+
+    def add_user(self, user_id, rate):
+        room_id = "!{}".format(user_id)
+        self.database.register_user(user_id)
+        self.database.user_data[user_id][KEY_ROOM] = room_id
+        self.room_users[room_id] = user_id
+        self.database.set_rate(user_id, rate)
+        first_sample_time = self.create_next_sample_time(self.clock.now(), rate)
+        self.schedule_next_sample(user_id, first_sample_time)
+
+    async def send_room_event(self, room_id, content):
+        msg = content["body"]
+        self.sent_messages.append((self.clock.now(), room_id, msg))
+        if msg.endswith("What's up?") and random.random() < self.reply_probability:
+            user_id = self.room_users[room_id]
+            asyncio.get_event_loop().create_task(self.reply(user_id, room_id))
+        return RoomSendResponse("$sim_event", room_id)
+
+    async def reply(self, user_id, room_id):
+        delay = random.expovariate(1.0/self.mean_reply_delay)
+        await self.clock.sleep(60*delay)
+        if self.database.get_user_state(user_id) == STATE_ACTIVITY_WAIT:
+            msg = random.choice(SIM_ACTIVITIES)
+            await self.run_as_user(user_id, self.handle_user_message(msg, user_id, room_id))
+
+
+async def simulate(n_users, duration, rate=45.0, data_dir=None, start=None):
+    """Run n_users for duration (datetime.timedelta), return the bot"""
+    clock = VirtualClock(start if start is not None else datetime(2020, 1, 1),
+                         resolution=SIM_CLOCK_RESOLUTION)
+    if data_dir is None:
+        data_dir = tempfile.mkdtemp(prefix="timeprof_sim_")
+    bot = SimulatedBot(clock, data_dir)
+    for i in range(n_users):
+        bot.add_user("@sim_user_{}:localhost".format(i), rate)
+    await clock.run_until(clock.now() + duration)
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await bot.close()
+    return bot
+
+
+def main():
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    days = float(sys.argv[2]) if len(sys.argv) > 2 else 14
+    start_time = time.perf_counter()
+    bot = asyncio.run(simulate(n_users, timedelta(days=days)))
+    elapsed = time.perf_counter() - start_time
+    print("{} users, {} days, {} messages in {:.2f} s".format(
+        n_users, days, len(bot.sent_messages), elapsed))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+from activity_index import get_index_path, load_index
+from samples import append_placeholders, format_sample_line
+
+START = datetime(2020, 1, 1, 12, 0, 0)
+
+
+def write_samples(path, labels):
+    with open(path, 'a') as f:
+        for i, label in enumerate(labels):
+            f.write(format_sample_line(START + timedelta(minutes=i), label, 45.0))
+
+
+def test_share(tmp_path):
+    path = tmp_path / "user.csv"
+    write_samples(path, ["work meeting", "work", "Sleep", "food"])
+    index = load_index(path)
+    assert index.get_share(all_of=["work"]) == (2, 4)
+    assert index.get_share(all_of=["work", "meeting"]) == (1, 4)
+    assert index.get_share(any_of=["sleep", "food"]) == (2, 4)
+    assert index.get_share(all_of=["work"], start=START + timedelta(minutes=1)) == (1, 3)
+
+
+def test_add_line_matches_file(tmp_path):
+    path = tmp_path / "user.csv"
+    write_samples(path, ["work"])
+    index = load_index(path)
+    line = append_placeholders(path, [START + timedelta(hours=1), START + timedelta(hours=2)], "EMPTY", 45.0)
+    index.add_line(line)
+    assert len(index) == 3
+    assert index.indexed_bytes == path.stat().st_size
+    assert index.get_share(all_of=["empty"]) == (2, 3)
+
+
+def test_saved_index_catches_up(tmp_path):
+    path = tmp_path / "user.csv"
+    write_samples(path, ["work", "sleep"])
+    load_index(path)
+    assert get_index_path(path).exists()
+    write_samples(path, ["work"])
+    append_placeholders(path, [START + timedelta(hours=1), START + timedelta(hours=2)], "EMPTY", 45.0)
+    index = load_index(path)
+    assert len(index) == 5
+    assert index.get_share(all_of=["work"]) == (2, 5)
+    assert index.indexed_bytes == path.stat().st_size
+
+
+def test_index_longer_than_file_is_rebuilt(tmp_path):
+    path = tmp_path / "user.csv"
+    write_samples(path, ["work", "sleep", "food"])
+    load_index(path)
+    path.write_text("")
+    write_samples(path, ["play"])
+    index = load_index(path)
+    assert len(index) == 1
+    assert index.get_share(all_of=["play"]) == (1, 1)
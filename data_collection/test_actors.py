@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from actors import UserActors
+
+
+def test_work_for_a_key_runs_in_order():
+    async def run():
+        actors = UserActors()
+        events = []
+
+        async def work(name, delay):
+            events.append(("start", name))
+            await asyncio.sleep(delay)
+            events.append(("end", name))
+            return name
+
+        futures = [actors.submit("a", work(i, 0.01*(3 - i))) for i in range(3)]
+        results = await asyncio.gather(*futures)
+        await actors.join()
+        return actors, events, results
+
+    actors, events, results = asyncio.run(run())
+    assert results == [0, 1, 2]
+    assert events == [("start", 0), ("end", 0), ("start", 1), ("end", 1), ("start", 2), ("end", 2)]
+    assert actors.get_queue_depth() == 0
+    assert not actors.workers
+
+
+def test_keys_run_concurrently_up_to_max_workers():
+    async def run():
+        actors = UserActors(max_workers=3)
+        running = 0
+        max_running = 0
+
+        async def work():
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        futures = [actors.submit(key, work()) for key in range(10) for i in range(2)]
+        assert actors.get_queue_depth(0) == 2
+        await asyncio.gather(*futures)
+        return max_running
+
+    assert asyncio.run(run()) == 3
+
+
+def test_exception_is_delivered_to_future():
+    async def run():
+        actors = UserActors()
+
+        async def fail():
+            raise ValueError("bad input")
+
+        async def succeed():
+            return "ok"
+
+        failed = actors.submit("a", fail())
+        after = actors.submit("a", succeed())
+        with pytest.raises(ValueError):
+            await failed
+        # Later work for the key still runs
+        return await after
+
+    assert asyncio.run(run()) == "ok"
+
+
+def test_cancelled_worker_cancels_queued_work():
+    async def run():
+        actors = UserActors()
+        started = asyncio.Event()
+
+        async def block():
+            started.set()
+            await asyncio.sleep(10)
+
+        async def never():
+            raise AssertionError("queued work ran after cancel")
+
+        blocked = actors.submit("a", block())
+        queued = actors.submit("a", never())
+        await started.wait()
+        actors.workers["a"].cancel()
+        await actors.join()
+        return blocked, queued, actors
+
+    blocked, queued, actors = asyncio.run(run())
+    assert blocked.cancelled()
+    assert queued.cancelled()
+    assert not actors.queues
+
+
+def test_exception_is_logged_without_awaiting(caplog):
+    async def run():
+        actors = UserActors()
+
+        async def fail():
+            raise ValueError("bad input")
+
+        actors.submit("a", fail())
+        await actors.join()
+
+    asyncio.run(run())
+    assert [record.getMessage() for record in caplog.records] == ["Work for a failed"]
+    assert caplog.records[0].exc_info[0] is ValueError
@@ -0,0 +1,65 @@
+import logging
+
+from bot_logging import RepeatFilter, setup_logging
+
+
+class FakeMonotonic():
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+def make_record(level, msg, *args):
+    return logging.LogRecord("bot", level, __file__, 0, msg, args, None)
+
+
+def test_distinct_messages_are_not_repeats():
+    repeat_filter = RepeatFilter(limit=2, interval=60.0, monotonic=FakeMonotonic())
+    passed = [repeat_filter.filter(make_record(logging.INFO, "Joined room %s", "!{}".format(i)))
+              for i in range(15)]
+    assert all(passed)
+
+
+def test_warnings_are_never_suppressed():
+    repeat_filter = RepeatFilter(limit=2, interval=60.0, monotonic=FakeMonotonic())
+    passed = [repeat_filter.filter(make_record(logging.WARNING, "Failed to join room %s", "!a"))
+              for i in range(15)]
+    assert all(passed)
+
+
+def test_suppressed_repeats_are_reported_when_window_ends():
+    monotonic = FakeMonotonic()
+    repeat_filter = RepeatFilter(limit=2, interval=60.0, monotonic=monotonic)
+    passed = [repeat_filter.filter(make_record(logging.INFO, "Handling %s", "x")) for i in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert repeat_filter.pop_reports() == []
+    monotonic.time = 60.0
+    reports = repeat_filter.pop_reports()
+    assert [report.getMessage() for report in reports] == ["Suppressed 3 repeats of: Handling x"]
+    assert not repeat_filter.windows
+    assert repeat_filter.filter(make_record(logging.INFO, "Handling %s", "x"))
+
+
+def test_pending_reports_are_written_on_stop():
+    class ListHandler(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.messages = []
+
+        def emit(self, record):
+            self.messages.append(record.getMessage())
+
+    handler = ListHandler()
+    root_logger = logging.getLogger()
+    old_handlers, old_level = root_logger.handlers, root_logger.level
+    listener = setup_logging(logging.INFO, handlers=[handler])
+    try:
+        for i in range(12):
+            logging.info("Handling message from %s", "@a:x")
+    finally:
+        listener.stop()
+        root_logger.handlers, root_logger.level = old_handlers, old_level
+    assert handler.messages[-1] == "Suppressed 2 repeats of: Handling message from @a:x"
+    assert len(handler.messages) == 11
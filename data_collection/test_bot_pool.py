@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from nio import JoinResponse, MatrixRoom, RoomInviteResponse, RoomLeaveResponse, RoomSendResponse
+
+from clock import VirtualClock
+from timeprof_matrix_bot import WELCOME_STR, BotPool, DataBase, TimeProfBot
+
+START = datetime(2020, 1, 1)
+
+
+class FakeBot(TimeProfBot):
+    def __init__(self, user_id, clock):
+        """Bot account that records joins, invites, leaves and sends"""
+        super().__init__("http://localhost:8008", user_id, "", clock=clock)
+        self.joined = []
+        self.invited = []
+        self.left = []
+        self.sent = []
+
+    async def join(self, room_id):
+        self.joined.append(room_id)
+        return JoinResponse(room_id)
+
+    async def room_invite(self, room_id, user_id):
+        self.invited.append((room_id, user_id))
+        return RoomInviteResponse()
+
+    async def room_leave(self, room_id):
+        self.left.append(room_id)
+        return RoomLeaveResponse()
+
+    async def send_room_event(self, room_id, content):
+        self.sent.append((room_id, content["body"]))
+        return RoomSendResponse("$event", room_id)
+
+
+def test_invite_is_handed_over_to_least_loaded_account(tmp_path):
+    async def run():
+        clock = VirtualClock(START)
+        bots = [FakeBot("@bot_{}:x".format(i), clock) for i in range(2)]
+        database = DataBase(tmp_path)
+        for bot in bots:
+            bot.database = database
+            bot.add_commands()
+        pool = BotPool(bots)
+        # Load the primary so the new user goes to the other account
+        database.register_user("@old:x")
+        database.set_account("@old:x", bots[0].user)
+        database.set_next_sample_time("@old:x", START + timedelta(days=1))
+
+        room = MatrixRoom("!new:x", bots[0].user)
+        await bots[0].handle_invite(room, SimpleNamespace(sender="@new:x"))
+        # Saving the new user before it has a sample time must work
+        database.save_user_states()
+        await bots[1].handle_handover_invite(room, bots[0])
+        await pool.flush()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await pool.close()
+        return bots, database
+
+    bots, database = asyncio.run(run())
+    assert bots[0].invited == [("!new:x", "@bot_1:x")]
+    assert bots[1].joined == ["!new:x"]
+    assert bots[0].left == ["!new:x"]
+    assert bots[1].sent == [("!new:x", WELCOME_STR)]
+    assert not bots[0].sent
+    assert database.get_room("@new:x") == "!new:x"
+
+    reloaded = DataBase(tmp_path)
+    reloaded.load_user_states()
+    assert reloaded.get_account("@new:x") == "@bot_1:x"
+    assert reloaded.get_next_sample_time("@new:x") > START
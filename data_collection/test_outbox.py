@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from nio import RoomSendError, RoomSendResponse
+
+from clock import VirtualClock
+from outbox import LIMIT_EXCEEDED, MAX_COALESCED_LENGTH, MAX_SEND_ATTEMPTS, Outbox
+
+START = datetime(2020, 1, 1)
+
+
+def text(body):
+    return {"msgtype": "m.text", "body": body}
+
+
+class FakeSender():
+    def __init__(self, clock, errors=()):
+        """Record sends, answering with the given errors first"""
+        self.clock = clock
+        self.errors = list(errors)
+        self.sent = []
+
+    async def __call__(self, room_id, content):
+        self.sent.append((self.clock.now(), room_id, content))
+        if self.errors:
+            return self.errors.pop(0)
+        return RoomSendResponse("$event", room_id)
+
+
+def test_consecutive_text_messages_are_joined():
+    async def run():
+        clock = VirtualClock(START)
+        sender = FakeSender(clock)
+        outbox = Outbox(sender, clock)
+        futures = [outbox.put("!a", text("one")), outbox.put("!a", text("two")),
+                   outbox.put("!a", {"msgtype": "m.file", "url": "mxc://x/y", "body": "data"}),
+                   outbox.put("!a", text("three")), outbox.put("!b", text("other room"))]
+        await outbox.flush()
+        return sender.sent, futures, outbox.stats
+
+    sent, futures, stats = asyncio.run(run())
+    by_room = {}
+    for _, room_id, content in sent:
+        by_room.setdefault(room_id, []).append(content)
+    assert by_room["!a"] == [text("one\ntwo"), {"msgtype": "m.file", "url": "mxc://x/y", "body": "data"},
+                             text("three")]
+    assert by_room["!b"] == [text("other room")]
+    assert all(isinstance(future.result(), RoomSendResponse) for future in futures)
+    assert (stats.n_events, stats.n_coalesced) == (4, 1)
+
+
+def test_coalesced_length_is_limited():
+    async def run():
+        clock = VirtualClock(START)
+        sender = FakeSender(clock)
+        outbox = Outbox(sender, clock)
+        body = "x"*(MAX_COALESCED_LENGTH//2 - 1)
+        for i in range(3):
+            outbox.put("!a", text(body))
+        await outbox.flush()
+        return sender.sent
+
+    sent = asyncio.run(run())
+    assert [len(content["body"]) for _, _, content in sent] == \
+        [MAX_COALESCED_LENGTH - 1, MAX_COALESCED_LENGTH//2 - 1]
+
+
+def test_rate_limited_send_waits_retry_after():
+    async def run():
+        clock = VirtualClock(START)
+        error = RoomSendError("Too many requests", LIMIT_EXCEEDED, retry_after_ms=5000)
+        sender = FakeSender(clock, errors=[error])
+        outbox = Outbox(sender, clock)
+        future = outbox.put("!a", text("hello"))
+        await clock.run_until(START + timedelta(minutes=1))
+        await outbox.flush()
+        return sender.sent, await future, outbox.stats
+
+    sent, resp, stats = asyncio.run(run())
+    assert isinstance(resp, RoomSendResponse)
+    assert [time for time, _, _ in sent] == [START, START + timedelta(seconds=5)]
+    assert stats.n_retries == 1
+
+
+def test_send_fails_after_max_attempts():
+    async def run():
+        clock = VirtualClock(START)
+        errors = [RoomSendError("Too many requests", LIMIT_EXCEEDED) for i in range(MAX_SEND_ATTEMPTS)]
+        sender = FakeSender(clock, errors=errors)
+        outbox = Outbox(sender, clock)
+        future = outbox.put("!a", text("hello"))
+        await clock.run_until(START + timedelta(hours=1))
+        await outbox.flush()
+        return sender.sent, await future, outbox.stats
+
+    sent, resp, stats = asyncio.run(run())
+    assert isinstance(resp, RoomSendError)
+    assert len(sent) == MAX_SEND_ATTEMPTS
+    assert stats.n_failed == 1
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+import population
+from samples import BOT_OFF_LABEL, UNANSWERED_LABEL, append_placeholders, format_sample_line
+
+START = datetime(2020, 1, 1, 12, 0, 0)
+
+
+def write_samples(path, labels, rate=45.0):
+    with open(path, 'a') as f:
+        for i, label in enumerate(labels):
+            f.write(format_sample_line(START + timedelta(minutes=i), label, rate))
+
+
+def make_files(data_dir):
+    write_samples(data_dir / "@a:x.csv", ["work meeting", "work", "sleep"])
+    append_placeholders(data_dir / "@a:x.csv", [START + timedelta(hours=1)], UNANSWERED_LABEL, 45.0)
+    write_samples(data_dir / "@b:x.csv", ["work", "food"], rate=30.0)
+    append_placeholders(data_dir / "@b:x.csv", [START + timedelta(hours=i) for i in range(1, 4)],
+                        BOT_OFF_LABEL, 30.0)
+
+
+def test_map_merge_build(tmp_path):
+    make_files(tmp_path)
+    total = population.empty_partial()
+    for name in ["@a:x.csv", "@b:x.csv"]:
+        population.merge_partials(total, population.map_sample_file(tmp_path / name))
+    assert (total["n_users"], total["n_samples"], total["n_unanswered"], total["n_bot_off"]) == (2, 9, 1, 3)
+    assert total["label_counts"] == {"work meeting": 1, "work": 2, "sleep": 1, "food": 1}
+    assert total["label_minutes"]["work"] == 45.0 + 30.0
+    assert total["word_users"] == {"work": 2, "meeting": 1, "sleep": 1, "food": 1}
+
+    tables = population.build_tables(total)
+    assert tables["users"] == 2
+    # 5 answered out of 6 asked, pings missed while the bot was off weren't asked
+    assert tables["response_rate"] == 5/6
+    assert tables["placeholder_ratio"] == 4/9
+    assert tables["bot_off_ratio"] == 3/9
+    assert tables["labels"][0]["label"] == "work"
+    assert tables["labels"][0]["time_share"] == 75.0/(3*45.0 + 2*30.0)
+    assert tables["vocabulary"][0] == {"word": "work", "users": 2}
+
+
+def test_unchanged_files_are_not_rescanned(tmp_path):
+    make_files(tmp_path)
+    tables, n_scanned = population.run(tmp_path, n_workers=1)
+    assert n_scanned == 2
+    again, n_scanned = population.run(tmp_path, n_workers=1)
+    assert n_scanned == 0
+    assert again == tables
+
+    write_samples(tmp_path / "@b:x.csv", ["work"], rate=30.0)
+    (tmp_path / "@a:x.csv").unlink()
+    tables, n_scanned = population.run(tmp_path, n_workers=1)
+    assert n_scanned == 1
+    assert (tables["users"], tables["samples"]) == (1, 6)
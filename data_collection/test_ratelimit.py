@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+from clock import VirtualClock
+from ratelimit import MAX_USER_QUEUE_DEPTH, InboundLimiter, TokenBucket
+
+START = datetime(2020, 1, 1)
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2.0, capacity=3, now=START)
+    assert [bucket.take(START) for i in range(4)] == [True, True, True, False]
+    assert bucket.take(START + timedelta(seconds=0.5))
+    assert not bucket.take(START + timedelta(seconds=0.5))
+    # Never more than capacity, however long it was idle
+    later = START + timedelta(hours=1)
+    assert [bucket.take(later) for i in range(4)] == [True, True, True, False]
+
+
+def test_user_limit_is_per_user():
+    clock = VirtualClock(START)
+    limiter = InboundLimiter(clock, user_rate=1.0, user_burst=2, global_rate=100.0, global_burst=100)
+    assert [limiter.allow("@a:x") for i in range(3)] == [True, True, False]
+    assert limiter.allow("@b:x")
+    assert limiter.dropped["user_rate"] == 1
+    clock.time += timedelta(seconds=1)
+    assert limiter.allow("@a:x")
+
+
+def test_global_limit():
+    clock = VirtualClock(START)
+    limiter = InboundLimiter(clock, user_rate=10.0, user_burst=10, global_rate=1.0, global_burst=3)
+    allowed = [limiter.allow("@user_{}:x".format(i)) for i in range(5)]
+    assert allowed == [True, True, True, False, False]
+    assert limiter.dropped["global_rate"] == 2
+
+
+def test_full_queue_is_dropped():
+    limiter = InboundLimiter(VirtualClock(START))
+    assert not limiter.allow("@a:x", queue_depth=MAX_USER_QUEUE_DEPTH)
+    assert limiter.dropped["queue_full"] == 1
+    assert limiter.allow("@a:x", queue_depth=MAX_USER_QUEUE_DEPTH - 1)
+
+
+def test_error_replies_are_coalesced():
+    clock = VirtualClock(START)
+    limiter = InboundLimiter(clock, error_reply_interval=timedelta(seconds=30))
+    assert limiter.take_error_reply("@a:x") == 0
+    assert limiter.take_error_reply("@a:x") is None
+    assert limiter.take_error_reply("@a:x") is None
+    assert limiter.take_error_reply("@b:x") == 0
+    clock.time += timedelta(seconds=30)
+    # The next reply tells how many were held back
+    assert limiter.take_error_reply("@a:x") == 2
+    assert limiter.take_error_reply("@a:x") is None
+    assert limiter.dropped["error_replies"] == 3
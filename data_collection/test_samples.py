@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from samples import (
+    Sample,
+    SampleRange,
+    append_placeholders,
+    compact_sample_file,
+    compact_sample_files,
+    format_record_line,
+    format_sample_line,
+    iter_records,
+    iter_samples,
+    lock_sample_files,
+    parse_sample_line
+)
+
+START = datetime(2020, 1, 1, 12, 0, 0)
+
+
+def test_sample_round_trip():
+    sample = Sample(START, "work, meeting", 45.0)
+    record = parse_sample_line(format_record_line(sample))
+    assert isinstance(record, Sample)
+    assert (record.time, record.label, record.rate) == (START, "work, meeting", 45.0)
+
+
+def test_range_round_trip():
+    sample_range = SampleRange(START, START + timedelta(hours=2), 3, "EMPTY (BOT OFF)", 30.0)
+    record = parse_sample_line(format_record_line(sample_range))
+    assert isinstance(record, SampleRange)
+    assert (record.start, record.end, record.count, record.label, record.rate) == \
+        (sample_range.start, sample_range.end, 3, "EMPTY (BOT OFF)", 30.0)
+
+
+def test_single_sample_range_is_written_as_sample():
+    line = format_record_line(SampleRange(START, START, 1, "EMPTY", 45.0))
+    assert line == format_sample_line(START, "EMPTY", 45.0)
+
+
+def test_range_expand():
+    end = START + timedelta(hours=2)
+    samples = list(SampleRange(START, end, 3, "EMPTY", 45.0).expand())
+    assert [sample.time for sample in samples] == [START, START + timedelta(hours=1), end]
+    assert all(sample.is_placeholder() for sample in samples)
+    assert len(list(SampleRange(START, START, 1, "EMPTY", 45.0).expand())) == 1
+
+
+def test_append_placeholders_appends_runs(tmp_path):
+    path = tmp_path / "user.csv"
+    times = [START + timedelta(minutes=i) for i in range(5)]
+    with open(path, 'w') as f:
+        f.write(format_sample_line(START - timedelta(hours=1), "work", 45.0))
+    before = path.read_bytes()
+    assert append_placeholders(path, times[:2], "EMPTY (BOT OFF)", 45.0).startswith("~")
+    assert not append_placeholders(path, times[2:3], "EMPTY (BOT OFF)", 45.0).startswith("~")
+    append_placeholders(path, times[3:], "EMPTY", 45.0)
+    # Earlier lines are never rewritten
+    assert path.read_bytes().startswith(before)
+    assert [len(record) for record in iter_records(path)] == [1, 2, 1, 2]
+    assert len(list(iter_samples(path))) == 6
+
+
+def test_compact_merges_runs_of_same_label_and_rate(tmp_path):
+    path = tmp_path / "user.csv"
+    times = [START + timedelta(minutes=i) for i in range(6)]
+    append_placeholders(path, times[:2], "EMPTY (BOT OFF)", 45.0)
+    append_placeholders(path, times[2:3], "EMPTY (BOT OFF)", 45.0)
+    append_placeholders(path, times[3:4], "EMPTY (BOT OFF)", 30.0)
+    append_placeholders(path, times[4:], "EMPTY", 30.0)
+    compact_sample_file(path)
+    records = list(iter_records(path))
+    assert [(len(record), record.label, record.rate) for record in records] == \
+        [(3, "EMPTY (BOT OFF)", 45.0), (1, "EMPTY (BOT OFF)", 30.0), (2, "EMPTY", 30.0)]
+    assert records[0].start == times[0] and records[0].end == times[2]
+
+
+def test_partial_last_line_is_skipped(tmp_path):
+    path = tmp_path / "user.csv"
+    with open(path, 'w') as f:
+        f.write(format_sample_line(START, "work", 45.0))
+        f.write(format_sample_line(START, "sleep", 45.0)[:-5])
+    assert [record.label for record in iter_records(path)] == ["work"]
+
+
+def test_compaction_refuses_locked_files(tmp_path):
+    path = tmp_path / "user.csv"
+    times = [START + timedelta(minutes=i) for i in range(2)]
+    append_placeholders(path, times[:1], "EMPTY", 45.0)
+    append_placeholders(path, times[1:], "EMPTY", 45.0)
+    before = path.read_bytes()
+    with lock_sample_files(tmp_path):
+        with pytest.raises(RuntimeError):
+            compact_sample_files([path])
+    assert path.read_bytes() == before
+    compact_sample_files([path])
+    assert [len(record) for record in iter_records(path)] == [2]
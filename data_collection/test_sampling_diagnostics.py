@@ -0,0 +1,40 @@
+import asyncio
+import random
+from datetime import timedelta
+
+import numpy as np
+
+import sampling_diagnostics
+from sampling_diagnostics import (
+    ANSWERED,
+    UNANSWERED,
+    SCHEDULED,
+    SKIPPED,
+    EXACT,
+    LAGGED,
+    REPLY_LAG,
+    classify_intervals
+)
+from simulation import simulate
+
+
+def test_classify_intervals():
+    points = np.array([ANSWERED, UNANSWERED, ANSWERED, ANSWERED, UNANSWERED, UNANSWERED,
+                       SCHEDULED, SCHEDULED, ANSWERED])
+    inside_run = np.array([False, False, False, False, False, False, False, True, False])
+    kinds = classify_intervals(points, inside_run)
+    assert list(kinds) == [SKIPPED, REPLY_LAG, LAGGED, SKIPPED, EXACT, EXACT, SKIPPED, LAGGED]
+
+
+def test_simulated_samples_pass(tmp_path):
+    random.seed(1)
+    np.random.seed(1)
+    asyncio.run(simulate(20, timedelta(days=14), data_dir=tmp_path))
+    users, pooled = sampling_diagnostics.run(tmp_path, n_workers=1)
+    assert pooled["p_value"] > sampling_diagnostics.ALPHA
+    assert abs(pooled["mean"] - 1.0) < 0.05
+    assert pooled["clustering"] < 1.0
+    # Simulated users reply after 5 minutes on average
+    assert 0.0 < pooled["reply_lag_minutes"] < 10.0
+    n_rejected = sum(row["p_value"] < sampling_diagnostics.ALPHA for row in users)
+    assert n_rejected <= 2
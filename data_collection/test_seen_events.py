@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+from seen_events import SeenEvents, get_event_key
+
+
+def message(event_id):
+    return SimpleNamespace(source={"event_id": event_id, "type": "m.room.message", "sender": "@a:x"})
+
+
+def invite(sender):
+    # Invites are stripped state events without an ID
+    return SimpleNamespace(source={"type": "m.room.member", "sender": sender, "state_key": "@bot:x",
+                                   "content": {"membership": "invite"}})
+
+
+def test_is_replay():
+    seen_events = SeenEvents()
+    assert not seen_events.is_replay("!a", message("$1"))
+    assert seen_events.is_replay("!a", message("$1"))
+    assert not seen_events.is_replay("!a", message("$2"))
+    # Seen events are per room
+    assert not seen_events.is_replay("!b", message("$1"))
+    assert not seen_events.is_replay("!a", invite("@a:x"))
+    assert seen_events.is_replay("!a", invite("@a:x"))
+    assert not seen_events.is_replay("!a", invite("@b:x"))
+
+
+def test_least_recently_seen_is_evicted():
+    seen_events = SeenEvents(max_per_room=2)
+    for event_id in ["$1", "$2"]:
+        seen_events.is_replay("!a", message(event_id))
+    # Seeing $1 again makes $2 the oldest
+    assert seen_events.is_replay("!a", message("$1"))
+    assert not seen_events.is_replay("!a", message("$3"))
+    assert list(seen_events.rooms["!a"]) == ["$1", "$3"]
+    assert not seen_events.is_replay("!a", message("$2"))
+    assert not seen_events.is_replay("!b", message("$2"))
+    assert len(seen_events) == 3
+
+
+def test_remove_room():
+    seen_events = SeenEvents()
+    seen_events.is_replay("!a", invite("@a:x"))
+    seen_events.remove_room("!a")
+    assert not seen_events.is_replay("!a", invite("@a:x"))
+
+
+def test_only_event_ids_are_saved(tmp_path):
+    path = tmp_path / "seen_events.json"
+    seen_events = SeenEvents()
+    seen_events.is_replay("!a", message("$1"))
+    seen_events.is_replay("!a", invite("@a:x"))
+    seen_events.is_replay("!b", message("$2"))
+    assert seen_events.to_dict() == {"!a": ["$1"], "!b": ["$2"]}
+    seen_events.save(path)
+    assert not seen_events.changed
+
+    loaded = SeenEvents.load(path)
+    assert loaded.to_dict() == seen_events.to_dict()
+    assert loaded.is_replay("!a", message("$1"))
+    assert not loaded.is_replay("!a", invite("@a:x"))
+
+
+def test_load_keeps_newest_events(tmp_path):
+    path = tmp_path / "seen_events.json"
+    seen_events = SeenEvents()
+    for i in range(5):
+        seen_events.is_replay("!a", message("${}".format(i)))
+    seen_events.save(path)
+    loaded = SeenEvents.load(path, max_per_room=2)
+    assert list(loaded.rooms["!a"]) == ["$3", "$4"]
+    assert SeenEvents.load(tmp_path / "missing.json").to_dict() == {}
+
+
+def test_event_key():
+    assert get_event_key(message("$1")) == "$1"
+    assert get_event_key(invite("@a:x")) != get_event_key(invite("@b:x"))
@@ -0,0 +1,66 @@
+import asyncio
+import pickle
+from datetime import datetime, timedelta
+
+from clock import VirtualClock
+from timeprof_matrix_bot import KEY_ROOM, SNAPSHOT_VERSION, DataBase, TimeProfBot
+
+START = datetime(2020, 1, 1)
+
+
+def make_database(data_dir):
+    database = DataBase(data_dir)
+    for i in range(3):
+        user_id = "@user_{}:x".format(i)
+        database.register_user(user_id)
+        database.user_data[user_id][KEY_ROOM] = "!{}:x".format(i)
+        database.set_next_sample_time(user_id, START + timedelta(hours=3 - i))
+    return database
+
+
+def test_snapshot_round_trip(tmp_path):
+    database = make_database(tmp_path)
+    database.save_user_states()
+    database.save_snapshot()
+    loaded = DataBase(tmp_path)
+    schedule = loaded.load_snapshot()
+    assert schedule == database.get_schedule()
+    assert [user_id for _, user_id in schedule] == ["@user_2:x", "@user_1:x", "@user_0:x"]
+    assert loaded.user_data == database.user_data
+
+
+def test_snapshot_of_other_version_is_ignored(tmp_path):
+    database = make_database(tmp_path)
+    database.save_user_states()
+    database.save_snapshot()
+    with open(database.snapshot_path, 'rb') as fp:
+        snapshot = pickle.load(fp)
+    snapshot["version"] = SNAPSHOT_VERSION + 1
+    with open(database.snapshot_path, 'wb') as fp:
+        pickle.dump(snapshot, fp)
+    loaded = DataBase(tmp_path)
+    assert loaded.load_snapshot() is None
+    assert loaded.user_data == {}
+
+
+def test_snapshot_older_than_user_states_is_ignored(tmp_path):
+    database = make_database(tmp_path)
+    database.save_user_states()
+    database.save_snapshot()
+    # The user states file changes after the snapshot
+    database.set_rate("@user_0:x", 100.0)
+    assert DataBase(tmp_path).load_snapshot() is None
+
+
+def test_sample_task_of_unregistered_user_does_nothing(tmp_path):
+    async def run():
+        bot = TimeProfBot("http://localhost:8008", "@bot:x", "", clock=VirtualClock(START))
+        bot.database = make_database(tmp_path)
+        bot.database.unregister_user("@user_0:x")
+        await bot.collect_as_user("@user_0:x")
+        await bot.close()
+        return bot
+
+    bot = asyncio.run(run())
+    assert bot.outbox.get_queue_depth() == 0
+    assert not bot.database.is_user_registered("@user_0:x")
@@ -8,7 +8,10 @@ from nio import (
     AsyncClientConfig,
     RoomMemberEvent,
     RoomCreateEvent,
-    RoomLeaveError
+    RoomLeaveError,
+    SyncResponse,
+    UploadResponse,
+    UploadFilterResponse
 )
 import time
 import re
@@ -21,10 +24,30 @@ from datetime import (datetime, timedelta)
 from pathlib import Path
 import json
 import copy
+import pickle
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from samples import (
+    BOT_OFF_LABEL,
+    UNANSWERED_LABEL,
+    format_sample_line,
+    append_placeholders,
+    lock_sample_files
+)
+from activity_index import load_index
+from clock import Clock
+from actors import UserActors
+from bot_logging import setup_logging
+from ratelimit import InboundLimiter
+from outbox import Outbox
+from plots import render_activity_plot
+from seen_events import SeenEvents
 
 
 HOMESERVER = "https://matrix.org"
 BOT_USER_ID = "@timeprof_bot:matrix.org"
+# JSON object of extra bot accounts, {user_id: password}, to spread users over
+EXTRA_ACCOUNTS_ENV = "TIMEPROF_MATRIX_EXTRA_ACCOUNTS"
 
 STATE_NONE = 0
 STATE_ACTIVITY_WAIT = 1
@@ -35,13 +58,41 @@ KEY_NEW_ROOM = "new_room_id"
 KEY_ROOM = "room_id"
 KEY_RATE = "poisson_process_rate"
 KEY_NEXT_SAMPLE_TIME = "next_sample_time"
+KEY_ACCOUNT = "account_id"
+# {"key": samples and time range plotted, "uri": content URI of the upload}
+KEY_PLOT = "plot"
 
 PATH_TO_THIS_DIR = Path(__file__).absolute().parent
 DATA_DIR = PATH_TO_THIS_DIR.joinpath("data")
 USER_STATES_PATH = DATA_DIR.joinpath("user_states.json")
+# Written at shutdown, valid as long as the user states file is unchanged
+SNAPSHOT_PATH = DATA_DIR.joinpath("user_states.snapshot")
+SNAPSHOT_VERSION = 1
+SEEN_EVENTS_FILE_FORMAT = "seen_events-{}.json"
+SHUTDOWN_TIMEOUT_S = 10.0
+PLOT_DIR_NAME = "plots"
+# Processes rendering plots, shared by all accounts
+PLOT_WORKERS = 2
+
+SYNC_TIMEOUT_MS = 10000
+SYNC_TIMELINE_LIMIT = 10
+SYNC_STATS_LOG_INTERVAL = 100
+# Only these events are handled, everything else is filtered out of syncs.
+# Encrypted messages arrive as m.room.encrypted and are decrypted by nio.
+# The state section only has state from before the timeline, so encryption
+# turned on in a room already joined arrives as a timeline event.
+SYNC_TIMELINE_TYPES = ["m.room.message", "m.room.encrypted", "m.room.member", "m.room.create",
+                       "m.room.encryption"]
+SYNC_STATE_TYPES = ["m.room.member", "m.room.create", "m.room.encryption"]
+
+# Megolm sessions are reused for pings until either limit is reached
+# (nio defaults to 100 messages), then rotated and shared again
+GROUP_SESSION_MAX_MESSAGES = 1000
+GROUP_SESSION_MAX_AGE = timedelta(days=7)
 
 JOIN_ATTEMPT_LIMIT = 3
 LEAVE_ROOM_ATTEMPT_LIMIT = 10
+SLOW_DOWN_STR = "Too many messages, this one was ignored. Please slow down."
 WELCOME_STR = """Hello from TimeProf =D
 Type 'help' to see available inputs"""
 
@@ -61,9 +112,11 @@ HELP_STR = """Available inputs:
 -get rate - get current rate
 -get next - get time of next sample
 -get data - get a download link for the data
+-get plot - get an image of your activity
+-get share <words> - share of samples labelled with all of the words
+-get share any <words> - share of samples labelled with any of the words
 -        """
 # TODO: add ability to get data summary
-# TODO: add ability to get data vis image
 # TODO: user csv package to save the data
 # TODO: what happens if the bot is in both room switch and activity wait state for a user?
 
@@ -100,6 +153,77 @@ class Command():
         return await self.func(msg, room_id)
 
 
+def build_sync_filter(timeline_limit=SYNC_TIMELINE_LIMIT):
+    """Sync filter with only the events the bot reacts to and lazy-loaded members"""
+    return {
+        "presence": {"types": []},
+        "account_data": {"types": []},
+        "room": {
+            "timeline": {
+                "types": SYNC_TIMELINE_TYPES,
+                "limit": timeline_limit,
+                "lazy_load_members": True
+            },
+            "state": {
+                "types": SYNC_STATE_TYPES,
+                "lazy_load_members": True
+            },
+            "ephemeral": {"types": []},
+            "account_data": {"types": []}
+        }
+    }
+
+
+class SyncStats():
+    def __init__(self):
+        self.n_syncs = 0
+        self.total_bytes = 0
+        self.total_parse_time = 0.0
+        self.max_bytes = 0
+
+    def add(self, n_bytes, parse_time):
+        self.n_syncs += 1
+        self.total_bytes += n_bytes
+        self.total_parse_time += parse_time
+        self.max_bytes = max(self.max_bytes, n_bytes)
+
+    def __str__(self):
+        n_syncs = max(self.n_syncs, 1)
+        return "{} syncs, mean {:.0f} B (max {} B), mean parse time {:.2f} ms".format(
+            self.n_syncs, self.total_bytes/n_syncs, self.max_bytes,
+            1e3*self.total_parse_time/n_syncs)
+
+
+class SendStats():
+    def __init__(self):
+        self.n_plain = 0
+        self.plain_time = 0.0
+        self.n_encrypted = 0
+        self.n_key_shares = 0
+        self.key_time = 0.0
+        self.encrypt_time = 0.0
+        self.network_time = 0.0
+
+    def add_plain(self, network_time):
+        self.n_plain += 1
+        self.plain_time += network_time
+
+    def add_encrypted(self, key_time, encrypt_time, network_time):
+        self.n_encrypted += 1
+        self.key_time += key_time
+        self.encrypt_time += encrypt_time
+        self.network_time += network_time
+
+    def __str__(self):
+        n_plain = max(self.n_plain, 1)
+        n_encrypted = max(self.n_encrypted, 1)
+        return ("{} plaintext sends, mean {:.1f} ms; {} encrypted sends, mean key sharing {:.1f} ms "
+                "({} shares), encryption {:.2f} ms, network {:.1f} ms").format(
+            self.n_plain, 1e3*self.plain_time/n_plain,
+            self.n_encrypted, 1e3*self.key_time/n_encrypted, self.n_key_shares,
+            1e3*self.encrypt_time/n_encrypted, 1e3*self.network_time/n_encrypted)
+
+
 class User():
     def __init__(self):
         self.user_id
@@ -109,11 +233,20 @@ class User():
 
 
 class DataBase():
-    def __init__(self):
-        if not DATA_DIR.exists():
-            os.mkdir(DATA_DIR)
+    def __init__(self, data_dir=DATA_DIR, autosave=True):
+        """Create database from:
+        data_dir -- directory of user states and sample files (pathlib.Path)
+        autosave -- save user states on every change (bool)
+        """
+        self.data_dir = Path(data_dir)
+        self.user_states_path = self.data_dir.joinpath(USER_STATES_PATH.name)
+        self.snapshot_path = self.data_dir.joinpath(SNAPSHOT_PATH.name)
+        self.autosave = autosave
+        if not self.data_dir.exists():
+            os.mkdir(self.data_dir)
 
         self.user_data = {}
+        self.activity_indexes = {}
 
     def is_user_room_registered(self, user_id):
         if self.get_room(user_id):
@@ -134,28 +267,92 @@ class DataBase():
         user_dict[KEY_NEXT_SAMPLE_TIME] = None
         user_dict[KEY_STATE] = STATE_NONE
         self.user_data[user_id] = user_dict
-        logging.info("Registered user {},{}".format(user_id, user_dict))
+        logging.info("Registered user %s", user_id)
 
     def add_new_room(self, user_id, room_id):
         self.user_data[user_id][KEY_NEW_ROOM] = room_id
 
     def save_user_states(self):
-        with open(USER_STATES_PATH, 'w') as fp:
+        # Replace the file in one step so readers never see it half written
+        tmp_path = self.user_states_path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as fp:
             user_data_str = copy.deepcopy(self.user_data)
             for user_id in user_data_str.keys():
-                logging.info(self.get_next_sample_time(user_id))
-                user_data_str[user_id][KEY_NEXT_SAMPLE_TIME] = self.get_next_sample_time(user_id).isoformat()
+                # None for users that joined but aren't welcomed and scheduled yet
+                next_sample_time = user_data_str[user_id][KEY_NEXT_SAMPLE_TIME]
+                if next_sample_time is not None:
+                    user_data_str[user_id][KEY_NEXT_SAMPLE_TIME] = next_sample_time.isoformat()
             json.dump(user_data_str, fp)
+        os.replace(tmp_path, self.user_states_path)
 
     def load_user_states(self):
-        if USER_STATES_PATH.exists():
-            with open(USER_STATES_PATH, 'r') as fp:
+        if self.user_states_path.exists():
+            with open(self.user_states_path, 'r') as fp:
                 user_data_str = json.load(fp)
                 self.user_data = copy.deepcopy(user_data_str)
-                for user_id in self.user_data.keys():
-                    self.set_next_sample_time(
-                        user_id,
-                        datetime.fromisoformat(user_data_str[user_id][KEY_NEXT_SAMPLE_TIME]))
+                # Parse all times before anything is saved again
+                for user_dict in self.user_data.values():
+                    next_sample_time = user_dict[KEY_NEXT_SAMPLE_TIME]
+                    if next_sample_time is not None:
+                        user_dict[KEY_NEXT_SAMPLE_TIME] = datetime.fromisoformat(next_sample_time)
+
+    def get_user_states_key(self):
+        if not self.user_states_path.exists():
+            return None
+        stat = os.stat(self.user_states_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def save_snapshot(self):
+        """Save user states and the sample schedule in one pickle, tied to
+        the current user states file. Call save_user_states first.
+        """
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "user_states_key": self.get_user_states_key(),
+            "user_data": self.user_data,
+            "schedule": self.get_schedule()
+        }
+        tmp_path = self.snapshot_path.with_name(self.snapshot_path.name + ".tmp")
+        with open(tmp_path, 'wb') as fp:
+            pickle.dump(snapshot, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.snapshot_path)
+        logging.info("Saved snapshot of %s users to %s", len(self.user_data), self.snapshot_path)
+
+    def load_snapshot(self):
+        """Load user states from the snapshot and return the sample schedule,
+        or None if the snapshot is missing or older than the user states file
+        """
+        if not self.snapshot_path.exists():
+            return None
+        with open(self.snapshot_path, 'rb') as fp:
+            data = fp.read()
+        try:
+            snapshot = pickle.loads(data)
+        except Exception:
+            logging.exception("Failed to read snapshot %s", self.snapshot_path)
+            return None
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            logging.info("Ignoring snapshot of version %s", snapshot.get("version"))
+            return None
+        if snapshot["user_states_key"] != self.get_user_states_key():
+            logging.info("Ignoring snapshot older than %s", self.user_states_path)
+            return None
+        self.user_data = snapshot["user_data"]
+        logging.info("Loaded snapshot of %s users", len(self.user_data))
+        return snapshot["schedule"]
+
+    def get_schedule(self):
+        """Return [(next sample time, user_id)] sorted by time"""
+        return sorted((self.get_next_sample_time(user_id), user_id) for user_id in self.get_scheduled_users())
+
+    def get_scheduled_users(self):
+        """Users with a next sample time, i.e. all but those still joining"""
+        return [user_id for user_id, user_dict in self.user_data.items()
+                if user_dict.get(KEY_NEXT_SAMPLE_TIME) is not None]
+
+    def user_states_changed(self):
+        if self.autosave:
+            self.save_user_states()
 
     def switch_to_new_room(self, user_id):
         new_room_id = self.user_data.get(user_id).get(KEY_NEW_ROOM)
@@ -168,7 +365,7 @@ class DataBase():
 
     def unregister_user(self, user_id):
         self.user_data.pop(user_id, None)
-        self.save_user_states()
+        self.user_states_changed()
 
     def get_room(self, user_id):
         room_id = self.user_data[user_id].get(KEY_ROOM)
@@ -179,37 +376,67 @@ class DataBase():
             if self.user_data[user_id].get(KEY_NEW_ROOM) == room_id:
                 return(user_id)
 
+    def get_account(self, user_id):
+        return self.user_data.get(user_id).get(KEY_ACCOUNT)
+
+    def set_account(self, user_id, account_id):
+        # Saved with the first sample time, like the new room
+        self.user_data[user_id][KEY_ACCOUNT] = account_id
+
     def get_user_state(self, user_id):
         return self.user_data.get(user_id).get(KEY_STATE)
 
     def set_user_state(self, user_id, state):
         self.user_data[user_id][KEY_STATE] = state
-        self.save_user_states()
+        self.user_states_changed()
 
     def get_user_file_path(self, user_id):
-        user_file_path = DATA_DIR.joinpath("{}.csv".format(user_id))
+        user_file_path = self.data_dir.joinpath("{}.csv".format(user_id))
         return user_file_path
 
+    def get_plot_path(self, user_id, plot_key):
+        plot_dir = self.data_dir.joinpath(PLOT_DIR_NAME)
+        plot_dir.mkdir(exist_ok=True)
+        return plot_dir.joinpath("{}-{}.png".format(user_id, plot_key))
+
+    def get_plot(self, user_id):
+        return self.user_data.get(user_id).get(KEY_PLOT)
+
+    def set_plot(self, user_id, plot_key, uri):
+        self.user_data[user_id][KEY_PLOT] = {"key": plot_key, "uri": uri}
+        self.user_states_changed()
+
     def get_rate(self, user_id):
-        logging.info(self.user_data)
         return self.user_data.get(user_id).get(KEY_RATE)
 
     def set_rate(self, user_id, rate):
         self.user_data[user_id][KEY_RATE] = rate
-        self.save_user_states()
+        self.user_states_changed()
 
     def save_sample(self, user_id, sample_time, label):
         user_file_path = self.get_user_file_path(user_id)
         with open(user_file_path, 'a') as f:
             # TODO: use time when question was asked instead?
-            timestamp = str(sample_time)
             poisson_process_rate = self.user_data.get(user_id).get(KEY_RATE)
-            line_format_str = "{}, {}, {}\n"
-            line = line_format_str.format(timestamp,
-                                          label,
-                                          poisson_process_rate)
+            line = format_sample_line(sample_time, label, poisson_process_rate)
             f.write(line)
-        logging.info("Saving data '{}' to {}".format(line, user_file_path))
+        if user_id in self.activity_indexes:
+            self.activity_indexes[user_id].add_line(line)
+        logging.debug("Saving data '%s' to %s", line, user_file_path)
+
+    def save_placeholder_samples(self, user_id, sample_times, label):
+        """Save placeholder samples as one run"""
+        user_file_path = self.get_user_file_path(user_id)
+        poisson_process_rate = self.user_data.get(user_id).get(KEY_RATE)
+        line = append_placeholders(user_file_path, sample_times, label, poisson_process_rate)
+        if user_id in self.activity_indexes:
+            self.activity_indexes[user_id].add_line(line)
+        logging.info("Saving %s placeholder samples '%s' to %s", len(sample_times), label, user_file_path)
+
+    def get_activity_index(self, user_id):
+        if user_id not in self.activity_indexes:
+            self.activity_indexes[user_id] = load_index(self.get_user_file_path(user_id))
+        return self.activity_indexes[user_id]
 
     def get_next_sample_time(self, user_id):
         next_sample_time = self.user_data.get(user_id).get(KEY_NEXT_SAMPLE_TIME)
@@ -219,13 +446,33 @@ class DataBase():
     def set_next_sample_time(self, user_id, next_sample_time):
         assert isinstance(next_sample_time, datetime)
         self.user_data[user_id][KEY_NEXT_SAMPLE_TIME] = next_sample_time
-        logging.info(type(next_sample_time))
-        self.save_user_states()
+        self.user_states_changed()
 
 
 class TimeProfBot(AsyncClient):
-    def __init__(self, homeserver, mid, bot_pw):
+    def __init__(self, homeserver, mid, bot_pw, clock=None, sync_timeline_limit=SYNC_TIMELINE_LIMIT,
+                 plot_executor=None):
         self.bot_pw = bot_pw
+        self.sync_timeline_limit = sync_timeline_limit
+        self.sync_stats = SyncStats()
+        self.send_stats = SendStats()
+        # room_id -> time spent in the last encrypt() for the room
+        self.encrypt_times = {}
+        self.clock = clock if clock is not None else Clock()
+        # Work on a user's state is serialized per user, see actors.py
+        self.actors = UserActors()
+        self.inbound_limiter = InboundLimiter(self.clock)
+        self.outbox = Outbox(self.send_room_event, self.clock)
+        # Plots are rendered in other processes to keep the event loop free,
+        # the executor is owned by the caller. Without one plots are off.
+        self.plot_executor = plot_executor
+        # Events already handled, to ignore replays, see seen_events.py
+        self.seen_events = SeenEvents()
+        self.seen_events_path = None
+        # Whether the schedule was restored from a snapshot in init
+        self.restored = False
+        # Set when running as one of several accounts, see BotPool
+        self.pool = None
         client_config = AsyncClientConfig(
             max_limit_exceeded=0,
             max_timeouts=0,
@@ -241,10 +488,26 @@ class TimeProfBot(AsyncClient):
             config=client_config
         )
 
-    async def init(self, leave_all_rooms=False):
-        self.database = DataBase()
-        self.database.load_user_states()
-        self.sync_next_sample_times()
+    async def init(self, leave_all_rooms=False, database=None):
+        """Log in and register callbacks. Sample times are scheduled unless
+        database is given, which is then shared with the bot that owns it.
+        Rooms are kept when the schedule is restored from a snapshot.
+        """
+        if database is None:
+            self.database = DataBase()
+            schedule = self.database.load_snapshot()
+            if schedule is None:
+                self.database.load_user_states()
+                self.sync_next_sample_times()
+            else:
+                self.restore_schedule(schedule)
+                self.restored = True
+                # The joined rooms belong to the restored users
+                leave_all_rooms = False
+        else:
+            self.database = database
+        self.seen_events_path = self.database.data_dir.joinpath(SEEN_EVENTS_FILE_FORMAT.format(self.user))
+        self.seen_events = SeenEvents.load(self.seen_events_path)
         resp = await self.login(self.bot_pw)
         logging.info(resp)
         await self.log_joined_rooms()
@@ -255,6 +518,7 @@ class TimeProfBot(AsyncClient):
         self.add_event_callback(self.invite_callback, InviteMemberEvent)
         self.add_event_callback(self.room_member_callback, RoomMemberEvent)
         self.add_event_callback(self.room_create_callback, RoomCreateEvent)
+        self.add_response_callback(self.sync_callback, SyncResponse)
         logging.info("Initialised bot")
 
     def add_commands(self):
@@ -262,9 +526,14 @@ class TimeProfBot(AsyncClient):
             Command("help", self.handle_help_message, "list commands (this message)"),
             Command("info", self.handle_info_message, "info about the bot"),
             Command("get data", self.handle_get_data, "get a download link for the data"),
+            Command("get plot", self.handle_get_plot, "get an image of your activity"),
             Command("get next", self.handle_get_next_sample_time, "get time of next sample"),
             Command("get rate", self.handle_get_rate_message, "get current rate")
         ]
+        get_share_cmd = Command("get share", self.handle_get_share_message,
+                                "share of samples labelled with all words ('get share any <words>' for any word)")
+        get_share_cmd.add_argument("words", r".+")
+        self.commands.append(get_share_cmd)
         set_rate_cmd = Command("set rate", self.handle_set_rate_message, "set rate (minutes) of sampling process")
         set_rate_cmd.add_argument("rate", r"\d+")
         self.commands.append(set_rate_cmd)
@@ -278,34 +547,52 @@ class TimeProfBot(AsyncClient):
         for room_id in joined_rooms_resp.rooms:
             room_user = self.database.get_room_user(room_id)
             self.database.unregister_user(room_user)
-            logging.info("Leaving room {}".format(room_id))
-            for i in range(LEAVE_ROOM_ATTEMPT_LIMIT):
-                resp = await self.room_leave(room_id)
-                logging.info(resp)
-                if isinstance(resp, RoomLeaveError):
-                    await asyncio.sleep(resp.retry_after_ms * 1e-3)
-                else:
-                    break
+            await self.leave_room(room_id)
+
+    async def leave_room(self, room_id):
+        logging.info("Leaving room %s", room_id)
+        for i in range(LEAVE_ROOM_ATTEMPT_LIMIT):
+            resp = await self.room_leave(room_id)
+            logging.info(resp)
+            if isinstance(resp, RoomLeaveError):
+                await asyncio.sleep(resp.retry_after_ms * 1e-3)
+            else:
+                break
+        # The room may be joined again later, with invites looking the same
+        self.seen_events.remove_room(room_id)
 
     def sync_next_sample_times(self):
-        for user_id in self.database.user_data.keys():
+        for user_id in self.database.get_scheduled_users():
             self.sync_next_sample_time(user_id)
 
+    def restore_schedule(self, schedule):
+        """Start sample tasks from a snapshot schedule, see DataBase.get_schedule"""
+        time_now = self.clock.now()
+        for sample_time, user_id in schedule:
+            if sample_time <= time_now:
+                # Fill in the samples missed while the bot was off
+                self.sync_next_sample_time(user_id)
+            else:
+                self.start_sample_task(user_id, sample_time)
+        logging.info("Restored %s scheduled samples", len(schedule))
+
     def sync_next_sample_time(self, user_id):
         next_sample_time = self.database.get_next_sample_time(user_id)
-        time_now = datetime.now()
+        time_now = self.clock.now()
         rate = self.database.get_rate(user_id)
         # TODO: do this in a cleaner way. Should next_sample_time ever be None?
         if next_sample_time is None:
             new_sample_time = self.create_next_sample_time(time_now, rate)
         else:
             new_sample_time = next_sample_time
+            placeholder_times = []
             while new_sample_time <= time_now:
-                time_now = datetime.now()
-                logging.info("Saving placeholder sample")
-                self.database.save_sample(user_id, new_sample_time, "EMPTY (BOT OFF)")
+                time_now = self.clock.now()
+                placeholder_times.append(new_sample_time)
                 new_sample_time = self.create_next_sample_time(new_sample_time, rate)
-        logging.info("Setting next sample time for {} to {}".format(user_id, new_sample_time))
+            if placeholder_times:
+                self.database.save_placeholder_samples(user_id, placeholder_times, BOT_OFF_LABEL)
+        logging.info("Setting next sample time for %s to %s", user_id, new_sample_time)
         self.schedule_next_sample(user_id, new_sample_time)
 
     async def collect_user_activity(self, user_id):
@@ -313,7 +600,7 @@ class TimeProfBot(AsyncClient):
         sample_time = self.database.get_next_sample_time(user_id)
         if self.database.get_user_state(user_id) == STATE_ACTIVITY_WAIT:
             await self.send_room_message("Previous sample unanswered, saving placeholder label...", room_id)
-            self.database.save_sample(user_id, sample_time, "EMPTY")
+            self.database.save_placeholder_samples(user_id, [sample_time], UNANSWERED_LABEL)
         await self.send_room_message("What's up?", room_id)
         self.database.set_user_state(user_id, STATE_ACTIVITY_WAIT)
         rate = self.database.get_rate(user_id)
@@ -325,52 +612,105 @@ class TimeProfBot(AsyncClient):
         await self.send_room_message(resp, room_id)
         self.database.set_user_state(user_id, STATE_ROOM_SWITCH_WAIT)
 
+    def is_replay(self, room, event):
+        if self.seen_events.is_replay(room.room_id, event):
+            logging.info("Ignoring replayed %s in %s", type(event).__name__, room.room_id)
+            return True
+        return False
+
+    def save_seen_events(self):
+        if self.seen_events_path is not None:
+            self.seen_events.save(self.seen_events_path)
+
+    async def sync_callback(self, response):
+        self.save_seen_events()
+
     async def room_create_callback(self, room, event):
-        logging.info(event)
-        await self.handle_room_join(room.room_id)
+        if self.is_replay(room, event):
+            return
+        logging.info("Room %s created", room.room_id)
+        user_id = self.database.get_new_room_user(room.room_id)
+        self.actors.submit(user_id, self.handle_room_join(room.room_id))
+
+    def get_user_bot(self, user_id):
+        """The bot account that talks to user_id"""
+        if self.pool is None:
+            return self
+        return self.pool.get_bot(user_id)
 
     async def handle_room_join(self, room_id):
         user_id = self.database.get_new_room_user(room_id)
+        if user_id is None or self.get_user_bot(user_id) is not self:
+            return
+        if self.database.get_room(user_id) == room_id:
+            # Both the join after a handover and the room's create event get here
+            return
         if self.database.is_user_room_registered(user_id):
-            logging.info("User {} already registered with room {}".format(user_id, room_id))
+            logging.info("User %s already registered with room %s", user_id, room_id)
             await self.propose_to_switch_room(user_id, room_id)
         else:
             self.database.switch_to_new_room(user_id)
             await self.send_room_message(WELCOME_STR, room_id)
             rate = self.database.get_rate(user_id)
-            time_now = datetime.now()
+            time_now = self.clock.now()
             next_sample_time = self.create_next_sample_time(time_now, rate)
             self.schedule_next_sample(user_id, next_sample_time)
 
     async def room_member_callback(self, room, event):
+        if self.is_replay(room, event):
+            return
         if event.membership == "leave":
-            logging.info(self.database.user_data)
             user_id = self.database.get_room_user(room.room_id)
             if event.state_key == user_id:
-                logging.info("Leaving room {}".format(room.room_id))
-                await self.room_leave(room.room_id)
+                await self.leave_room(room.room_id)
         # Did the bot join a new room?
         elif event.state_key == self.user_id and event.membership == "join":
             # Apparently this can happen more than once after joining a room
-            logging.info(event.content)
-            logging.info(await self.joined_rooms())
+            logging.debug("Joined room %s: %s", room.room_id, event.content)
 
     async def invite_callback(self, room, event):
-        logging.info(event)
-        logging.info(event.state_key)
+        if self.is_replay(room, event):
+            return
+        logging.info("Invited to %s by %s", room.room_id, event.sender)
+        if self.pool is not None and self.pool.is_bot(event.sender):
+            # Another account hands over a user's room to this one
+            user_id = self.database.get_new_room_user(room.room_id)
+            inviter = self.pool.bots[event.sender]
+            self.actors.submit(user_id, self.handle_handover_invite(room, inviter))
+        else:
+            self.actors.submit(event.sender, self.handle_invite(room, event))
 
+    async def join_room(self, room_id):
         for join_attempt in range(JOIN_ATTEMPT_LIMIT):
-            resp = await self.join(room.room_id)
+            resp = await self.join(room_id)
             if isinstance(resp, JoinError):
-                logging.info("Failed to join room {}: {}".format(room.room_id, resp.message))
+                logging.info("Failed to join room %s: %s", room_id, resp.message)
             else:
-                logging.info("Joined room {}".format(room.room_id))
-                user_id = event.sender
-                if self.database.is_user_registered(user_id):
-                    self.database.add_new_room(user_id, room.room_id)
-                else:
-                    self.database.register_user(user_id)
-                break
+                logging.info("Joined room %s", room_id)
+                return True
+        return False
+
+    async def handle_handover_invite(self, room, inviter):
+        """Join a room another account was invited to and let it leave, so
+        only the assigned account syncs the room
+        """
+        if await self.join_room(room.room_id):
+            await self.handle_room_join(room.room_id)
+            logging.info("%s leaving %s after handing it over", inviter.user, room.room_id)
+            await inviter.leave_room(room.room_id)
+
+    async def handle_invite(self, room, event):
+        if await self.join_room(room.room_id):
+            user_id = event.sender
+            if not self.database.is_user_registered(user_id):
+                self.database.register_user(user_id)
+                if self.pool is not None:
+                    self.pool.assign_account(user_id)
+            self.database.add_new_room(user_id, room.room_id)
+            user_bot = self.get_user_bot(user_id)
+            if user_bot is not self:
+                logging.info("Inviting %s to %s for %s", user_bot.user, room.room_id, user_id)
+                await self.room_invite(room.room_id, user_bot.user)
 
     def is_simple_phrase(self, msg):
         ret = False
@@ -415,7 +755,6 @@ class TimeProfBot(AsyncClient):
 
     async def handle_info_message(self, msg, room_id):
         ret = False
-        logging.info(msg)
         if msg == "info":
             await self.send_info_message(room_id)
             ret = True
@@ -430,7 +769,6 @@ class TimeProfBot(AsyncClient):
 
     async def handle_set_rate_message(self, msg, room_id):
         ret = False
-        logging.info(msg)
         re_pattern = r"^set rate (\d+)$"
         m = re.match(re_pattern, msg)
         if m is not None:
@@ -462,6 +800,28 @@ class TimeProfBot(AsyncClient):
             ret = True
         return ret
 
+    async def handle_get_share_message(self, msg, room_id):
+        ret = False
+        re_pattern = r"^get share (any )?(.+)$"
+        m = re.match(re_pattern, msg)
+        if m is not None:
+            match_any, words_str = m.groups()
+            words = words_str.split()
+            user_id = self.database.get_room_user(room_id)
+            index = self.database.get_activity_index(user_id)
+            if match_any:
+                n_matching, n_total = index.get_share(any_of=words)
+            else:
+                n_matching, n_total = index.get_share(all_of=words)
+            if n_total > 0:
+                response = "'{}' in {} of {} samples ({:.1f}%)".format(
+                    words_str, n_matching, n_total, 100.0*n_matching/n_total)
+            else:
+                response = "There is no data"
+            await self.send_room_message(response, room_id)
+            ret = True
+        return ret
+
     async def handle_get_data(self, msg, room_id):
         ret = False
         if msg == "get data":
@@ -469,36 +829,63 @@ class TimeProfBot(AsyncClient):
             ret = True
         return ret
 
+    async def handle_get_plot(self, msg, room_id):
+        ret = False
+        if msg == "get plot":
+            await self.send_plot(room_id)
+            ret = True
+        return ret
+
     async def wait_until(self, dt):
         # sleep until the specified datetime
-        now = datetime.now()
-        await asyncio.sleep((dt - now).total_seconds())
+        await self.clock.sleep_until(dt)
 
     async def run_at(self, dt, coro):
-        await self.wait_until(dt)
+        try:
+            await self.wait_until(dt)
+        except asyncio.CancelledError:
+            coro.close()
+            raise
         return await coro
 
+    async def run_as_user(self, user_id, coro):
+        return await self.actors.submit(user_id, coro)
+
+    async def collect_as_user(self, user_id):
+        if not self.database.is_user_registered(user_id):
+            logging.info("Not sampling %s, no longer registered", user_id)
+            return
+        user_bot = self.get_user_bot(user_id)
+        try:
+            await self.run_as_user(user_id, user_bot.collect_user_activity(user_id))
+        except Exception:
+            # Logged by the actor, and nothing waits for the sample task
+            pass
+
     def create_next_sample_time(self, prev_sample_time, rate):
         interval = np.random.exponential(scale=rate)
         next_sample_time = prev_sample_time + timedelta(minutes=interval)
         return next_sample_time
 
     def schedule_next_sample(self, user_id, sample_time):
-        loop = asyncio.get_event_loop()
         self.database.set_next_sample_time(user_id, sample_time)
-        loop.create_task(self.run_at(sample_time, self.collect_user_activity(user_id)))
-        logging.info("Scheduled new sample time at {}".format(sample_time))
+        self.start_sample_task(user_id, sample_time)
+        logging.debug("Scheduled new sample time at %s", sample_time)
+
+    def start_sample_task(self, user_id, sample_time):
+        loop = asyncio.get_event_loop()
+        loop.create_task(self.run_at(sample_time, self.collect_as_user(user_id)))
 
     async def handle_activity_message(self, msg, user_id, room_id):
         if self.is_activity_string(msg):
             resp = "Cool, I'll remember that >:)"
             await self.send_room_message(resp, room_id)
-            time_now = datetime.now()
+            time_now = self.clock.now()
             self.database.save_sample(user_id, time_now, msg)
             self.database.set_user_state(user_id, STATE_NONE)
         else:
             err_str = "Activity string '{}' is not valid.".format(msg)
-            await self.send_room_message(err_str, room_id)
+            await self.send_error_message(err_str, user_id, room_id)
 
     async def handle_room_switch_message(self, msg, user_id, room_id):
         if msg == "yes":
@@ -508,12 +895,12 @@ class TimeProfBot(AsyncClient):
         elif msg == "no":
             await self.send_room_message("Ok, I'm out", room_id)
             self.database.set_user_state(user_id, STATE_NONE)
-            self.leave_room(room_id)
+            await self.leave_room(room_id)
         else:
             err_str = "Expected yes or no, not '{}'".format(msg)
-            await self.send_room_message(err_str, room_id)
+            await self.send_error_message(err_str, user_id, room_id)
 
-    async def handle_command(self, msg, room_id):
+    async def handle_command(self, msg, user_id, room_id):
         msg_lowercase = msg.lower()
         command_recognized = False
         for command in self.commands:
@@ -524,40 +911,108 @@ class TimeProfBot(AsyncClient):
             #command_recognized = True
         if not command_recognized:
             response_msg = "'{}' is not valid input. Send 'help' to list valid input".format(msg)
-            await self.send_room_message(response_msg, room_id)
+            await self.send_error_message(response_msg, user_id, room_id)
 
     async def handle_message(self, msg, user_id, room_id):
         state = self.database.get_user_state(user_id)
-        logging.info("Handling valid message '{}' in state {}".format(msg, state))
+        logging.info("Handling message '%s' in state %s", msg, state)
         if state == STATE_ACTIVITY_WAIT:
             await self.handle_activity_message(msg, user_id, room_id)
         elif state == STATE_ROOM_SWITCH_WAIT:
             await self.handle_room_switch_message(msg, user_id, room_id)
         elif state == STATE_NONE:
-            await self.handle_command(msg, room_id)
+            await self.handle_command(msg, user_id, room_id)
 
     async def message_callback(self, room, event):
+        if self.is_replay(room, event):
+            return
+        msg = event.body
+        if self.database.is_user_registered(event.sender):
+            if self.get_user_bot(event.sender) is not self:
+                return
+            queue_depth = self.actors.get_queue_depth(event.sender)
+            if not self.inbound_limiter.allow(event.sender, queue_depth):
+                logging.warning("Dropping message from %s, dropped so far: %s",
+                                event.sender, self.inbound_limiter.dropped)
+                # Otherwise an answer to a ping would be lost without notice
+                await self.send_error_message(SLOW_DOWN_STR, event.sender, room.room_id)
+                return
+            self.actors.submit(event.sender, self.handle_user_message(msg, event.sender, room.room_id))
+        else:
+            logging.info("Discarding message %s", msg)
+
+    async def handle_user_message(self, msg, user_id, room_id):
         try:
-            msg = event.body
-            if self.database.is_user_registered(event.sender):
-                await self.handle_message(msg, event.sender, room.room_id)
-            else:
-                logging.info("Discarding message {}".format(msg))
-        except:
+            await self.handle_message(msg, user_id, room_id)
+        except Exception:
+            logging.exception("Failed to handle message '%s' from %s", msg, user_id)
             resp = "Sorry, there was en error. Contact the developer :("
-            await self.send_room_message(resp, room.room_id)
-            raise
+            await self.send_room_message(resp, room_id)
+
+    async def send_error_message(self, msg, user_id, room_id):
+        """Reply to invalid or ignored input, at most once per interval per user"""
+        n_held = self.inbound_limiter.take_error_reply(user_id)
+        if n_held is None:
+            return
+        if n_held > 0:
+            msg = "{}\n({} more invalid or ignored inputs since the last reply)".format(msg, n_held)
+        await self.send_room_message(msg, room_id)
 
     async def send_room_message(self, msg, room_id):
-        await self.room_send(
+        """Queue a text message, return a future with the send response"""
+        content = {
+            "msgtype": "m.text",
+            "body": msg
+        }
+        return self.outbox.put(room_id, content)
+
+    async def send_room_event(self, room_id, content):
+        room = self.rooms.get(room_id)
+        encrypted = self.olm is not None and room is not None and room.encrypted
+        start_time = time.perf_counter()
+        if encrypted:
+            await self.prepare_encrypted_send(room_id)
+        prepared_time = time.perf_counter()
+        self.encrypt_times.pop(room_id, None)
+        resp = await self.room_send(
             room_id=room_id,
             message_type="m.room.message",
-            content={
-                "msgtype": "m.text",
-                "body": msg
-            },
+            content=content,
             ignore_unverified_devices=True
         )
+        send_time = time.perf_counter() - prepared_time
+        if encrypted:
+            encrypt_time = self.encrypt_times.pop(room_id, 0.0)
+            self.send_stats.add_encrypted(prepared_time - start_time, encrypt_time, send_time - encrypt_time)
+        else:
+            self.send_stats.add_plain(send_time)
+        return resp
+
+    async def prepare_encrypted_send(self, room_id):
+        """Sync members and share a group session if needed, so that
+        room_send only has to encrypt
+        """
+        room = self.rooms[room_id]
+        if not room.members_synced:
+            await self.joined_members(room_id)
+            if self.should_query_keys:
+                await self.keys_query()
+        if self.olm.should_share_group_session(room_id):
+            if room_id in self.sharing_session:
+                await self.sharing_session[room_id].wait()
+            else:
+                await self.share_group_session(room_id, ignore_unverified_devices=True)
+                self.send_stats.n_key_shares += 1
+        session = self.olm.outbound_group_sessions.get(room_id)
+        if session is not None:
+            session.max_messages = GROUP_SESSION_MAX_MESSAGES
+            session.max_age = GROUP_SESSION_MAX_AGE
+
+    def encrypt(self, room_id, event_type, content):
+        start_time = time.perf_counter()
+        ret = super().encrypt(room_id, event_type, content)
+        self.encrypt_times[room_id] = time.perf_counter() - start_time
+        return ret
 
     async def send_to_all_registered_users(self, msg):
         for user_id in self.database.user_data.keys():
@@ -576,38 +1031,225 @@ class TimeProfBot(AsyncClient):
                     filename=file_path,
                     filesize=file_stat.st_size
                 )
-            await self.room_send(
-                room_id=room_id,
-                message_type="m.room.message",
-                content={
-                    "msgtype": "m.file",
-                    "url": resp.content_uri,
-                    "body": "TimeProf data"
-                }
-            )
+            content = {
+                "msgtype": "m.file",
+                "url": resp.content_uri,
+                "body": "TimeProf data"
+            }
+            self.outbox.put(room_id, content)
         else:
             await self.send_room_message("There is no data", room_id)
 
+    async def upload_plot(self, user_id):
+        """Render and upload a plot of the user's samples, or reuse the last
+        upload if no samples were added since. Returns the content URI or None.
+        """
+        index = self.database.get_activity_index(user_id)
+        if len(index) == 0:
+            return None
+        plot_key = "{}-{:.0f}-{:.0f}".format(len(index), index.times[0], index.times[-1])
+        plot = self.database.get_plot(user_id)
+        if plot is not None and plot["key"] == plot_key:
+            return plot["uri"]
+
+        sample_path = self.database.get_user_file_path(user_id)
+        plot_path = self.database.get_plot_path(user_id, plot_key)
+        start_time = time.perf_counter()
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.plot_executor, render_activity_plot, str(sample_path), str(plot_path))
+        logging.info("Rendered plot for %s in %.3f s", user_id, time.perf_counter() - start_time)
+
+        file_stat = await aiofiles.os.stat(plot_path)
+        async with aiofiles.open(plot_path, "r+b") as f:
+            resp, maybe_keys = await self.upload(
+                f,
+                content_type="image/png",
+                filename=plot_path.name,
+                filesize=file_stat.st_size
+            )
+        await aiofiles.os.remove(plot_path)
+        if not isinstance(resp, UploadResponse):
+            logging.warning("Failed to upload plot for %s: %s", user_id, resp)
+            return None
+        self.database.set_plot(user_id, plot_key, resp.content_uri)
+        return resp.content_uri
+
+    async def send_plot(self, room_id):
+        if self.plot_executor is None:
+            await self.send_room_message("Plots are not available", room_id)
+            return
+        user_id = self.database.get_room_user(room_id)
+        uri = await self.upload_plot(user_id)
+        if uri is None:
+            await self.send_room_message("There is no data", room_id)
+            return
+        content = {
+            "msgtype": "m.image",
+            "url": uri,
+            "body": "TimeProf activity"
+        }
+        self.outbox.put(room_id, content)
+
+    async def create_matrix_response(self, response_class, transport_response, *args, **kwargs):
+        if response_class is not SyncResponse:
+            return await super().create_matrix_response(response_class, transport_response, *args, **kwargs)
+        body = await transport_response.read()
+        start_time = time.perf_counter()
+        resp = await super().create_matrix_response(response_class, transport_response, *args, **kwargs)
+        self.sync_stats.add(len(body), time.perf_counter() - start_time)
+        if self.sync_stats.n_syncs % SYNC_STATS_LOG_INTERVAL == 0:
+            logging.info("Sync stats: %s", self.sync_stats)
+            logging.info("Outbox: %s queued, %s", self.outbox.get_queue_depth(), self.outbox.stats)
+            logging.info("Sends: %s", self.send_stats)
+        return resp
+
+    async def upload_sync_filter(self):
+        sync_filter = build_sync_filter(self.sync_timeline_limit)
+        resp = await self.upload_filter(**sync_filter)
+        if isinstance(resp, UploadFilterResponse):
+            logging.info("Uploaded sync filter %s", resp.filter_id)
+            return resp.filter_id
+        logging.info("Failed to upload sync filter, sending it with every sync: %s", resp)
+        return sync_filter
+
     async def main(self):
-        await self.sync_forever(timeout=10000)
+        sync_filter = await self.upload_sync_filter()
+        await self.sync_forever(timeout=SYNC_TIMEOUT_MS, sync_filter=sync_filter)
+
+class BotPool():
+    def __init__(self, bots):
+        """Run several bot accounts that share one database, user actors,
+        inbound limits and scheduler. Each user talks to one account, kept
+        in the user state, and new users go to the least loaded account.
+        The first bot owns the shared state.
+        """
+        # Keyed by the configured user ID, user_id is only set on login
+        self.bots = {bot.user: bot for bot in bots}
+        self.primary = bots[0]
+        for bot in bots:
+            bot.pool = self
+            bot.actors = self.primary.actors
+            bot.inbound_limiter = self.primary.inbound_limiter
+            bot.clock = self.primary.clock
+
+    def is_bot(self, user_id):
+        return user_id in self.bots
+
+    def get_bot(self, user_id):
+        account_id = self.primary.database.get_account(user_id)
+        return self.bots.get(account_id, self.primary)
+
+    def get_loads(self, exclude_user_id=None):
+        loads = {account_id: 0 for account_id in self.bots}
+        for user_id in self.primary.database.user_data:
+            if user_id == exclude_user_id:
+                continue
+            # Users registered before there were several accounts talk to the primary
+            account_id = self.primary.database.get_account(user_id) or self.primary.user
+            if account_id in loads:
+                loads[account_id] += 1
+        return loads
+
+    def assign_account(self, user_id):
+        loads = self.get_loads(exclude_user_id=user_id)
+        account_id = min(loads, key=loads.get)
+        self.primary.database.set_account(user_id, account_id)
+        logging.info("Assigned %s to %s, loads: %s", user_id, account_id, loads)
+        return account_id
+
+    async def init(self, leave_all_rooms=False):
+        await self.primary.init(leave_all_rooms)
+        leave_all_rooms = leave_all_rooms and not self.primary.restored
+        for bot in self.bots.values():
+            if bot is not self.primary:
+                await bot.init(leave_all_rooms, database=self.primary.database)
+
+    async def main(self):
+        await asyncio.gather(*(bot.main() for bot in self.bots.values()))
+
+    async def run_until(self, stop_event):
+        """Run until stop_event (asyncio.Event) is set or a bot fails"""
+        main_task = asyncio.ensure_future(self.main())
+        stop_task = asyncio.ensure_future(stop_event.wait())
+        await asyncio.wait([main_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+        stop_task.cancel()
+        if main_task.done():
+            main_task.result()
+            return
+        main_task.cancel()
+        try:
+            await main_task
+        except asyncio.CancelledError:
+            pass
+
+    async def shutdown(self):
+        """Finish queued user work and messages, then save user states and
+        a snapshot for a fast restart
+        """
+        logging.info("Shutting down")
+        try:
+            await asyncio.wait_for(self.flush(), SHUTDOWN_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            logging.warning("Pending work not done after %s s, shutting down anyway", SHUTDOWN_TIMEOUT_S)
+        database = self.primary.database
+        database.save_user_states()
+        database.save_snapshot()
+        for bot in self.bots.values():
+            bot.save_seen_events()
+
+    async def flush(self):
+        await self.primary.actors.join()
+        for bot in self.bots.values():
+            await bot.outbox.flush()
+
+    async def send_to_all_registered_users(self, msg):
+        for user_id in self.primary.database.user_data.keys():
+            room_id = self.primary.database.get_room(user_id)
+            await self.get_bot(user_id).send_room_message(msg, room_id)
+        for bot in self.bots.values():
+            await bot.outbox.flush()
+
+    async def close(self):
+        for bot in self.bots.values():
+            await bot.close()
+
+
+def get_accounts():
+    accounts = {BOT_USER_ID: os.environ["TIMEPROF_MATRIX_PW"]}
+    if EXTRA_ACCOUNTS_ENV in os.environ:
+        accounts.update(json.loads(os.environ[EXTRA_ACCOUNTS_ENV]))
+    return accounts
+
 
 async def main():
-    pw = os.environ["TIMEPROF_MATRIX_PW"]
-    bot = TimeProfBot(HOMESERVER, BOT_USER_ID, pw)
-    logging.info("Initialising bot")
-    await bot.init(leave_all_rooms=True)
-    try:
-        await bot.main()
-    except:
+    accounts = get_accounts()
+    clock = Clock()
+    # Sample files aren't compacted while the lock is held, see samples.py
+    with ProcessPoolExecutor(max_workers=PLOT_WORKERS) as plot_executor, lock_sample_files(DATA_DIR):
+        bots = [TimeProfBot(HOMESERVER, user_id, pw, clock=clock, plot_executor=plot_executor)
+                for user_id, pw in accounts.items()]
+        pool = BotPool(bots)
+        logging.info("Initialising %s bot accounts", len(bots))
+        await pool.init(leave_all_rooms=True)
+        stop_event = asyncio.Event()
+        # systemd stops the service with SIGTERM
+        asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, stop_event.set)
         try:
-            await bot.send_to_all_registered_users("There was a problem. Shutting down...")
-            await bot.database.save_user_states()
+            await pool.run_until(stop_event)
         except:
-            pass
-        raise
-    await bot.client.close()
+            try:
+                await pool.send_to_all_registered_users("There was a problem. Shutting down...")
+                pool.primary.database.save_user_states()
+            except:
+                pass
+            raise
+        await pool.shutdown()
+        await pool.close()
 
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
-    asyncio.get_event_loop().run_until_complete(main())
+    log_listener = setup_logging(logging.INFO)
+    try:
+        asyncio.get_event_loop().run_until_complete(main())
+    finally:
+        log_listener.stop()
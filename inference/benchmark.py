@@ -0,0 +1,188 @@
+"""Benchmarks for schedule simulation, sample times and interval estimation.
+
+Times every step over growing horizons and sample counts, writes the
+results as JSON and flags regressions against a stored baseline.
+
+Usage:
+    python benchmark.py [--output results.json] [--baseline baseline.json]
+                        [--save-baseline baseline.json] [--threshold 0.25] [--plot]
+"""
+import argparse
+import datetime
+import json
+import platform
+import sys
+import time
+import numpy as np
+from schedule import Activity, RandomSchedule
+from inference import (
+    generate_sample_times,
+    normal_approximation_interval,
+    wilson_score_interval,
+    bootstrap_interval,
+    gamma_tom_jack,
+    gamma_daniel_reeves,
+    gamma_brute,
+    gamma_brute2,
+    gamma_brute3,
+    gamma_wiki
+)
+
+HORIZON_DAYS = [1, 7, 30, 365, 2*365]
+SAMPLE_COUNTS = [100, 1000, 10000, 100000]
+TAG_LOOKUPS = 200
+MEAN_INTERVAL = 45
+REPEAT = 3
+REGRESSION_THRESHOLD = 0.25
+SEED = 0
+
+TAGS = ['poop', 'food', 'play', 'sleep']
+MEAN_DURATIONS = [15, 45, 2*60, 6*60]
+
+ESTIMATORS = [
+    normal_approximation_interval,
+    wilson_score_interval,
+    bootstrap_interval,
+    gamma_tom_jack,
+    gamma_daniel_reeves,
+    gamma_brute,
+    gamma_brute2,
+    gamma_brute3,
+    gamma_wiki
+]
+
+
+def time_call(func, repeat=REPEAT):
+    """Best wall time in seconds of repeat calls to func"""
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return(best)
+
+
+def get_activities():
+    return([Activity(*arg) for arg in zip(TAGS, MEAN_DURATIONS)])
+
+
+def bench_schedules(results, horizons):
+    activities = get_activities()
+    start = datetime.datetime(2020, 1, 1)
+    for days in horizons:
+        end = start + datetime.timedelta(days)
+        results['schedule/days={}'.format(days)] = time_call(
+            lambda: RandomSchedule(start, end, activities))
+
+        schedule = RandomSchedule(start, end, activities)
+        offsets = np.random.uniform(0, (end - start).total_seconds(), TAG_LOOKUPS)
+        lookup_times = [start + datetime.timedelta(0, offset) for offset in offsets]
+        results['get_tag/days={}'.format(days)] = time_call(
+            lambda: [schedule.get_tag(t) for t in lookup_times])/TAG_LOOKUPS
+
+        results['generate_sample_times/days={}'.format(days)] = time_call(
+            lambda: generate_sample_times(start, end, MEAN_INTERVAL))
+
+
+def bench_estimators(results, sample_counts):
+    for n_samples in sample_counts:
+        tag_samples = np.random.choice(TAGS, size=n_samples, p=[0.02, 0.18, 0.3, 0.5])
+        for method in ESTIMATORS:
+            results['{}/n={}'.format(method.__name__, n_samples)] = time_call(
+                lambda: [method(tag_samples, tag) for tag in TAGS])
+
+
+def run(horizons=HORIZON_DAYS, sample_counts=SAMPLE_COUNTS):
+    np.random.seed(SEED)
+    results = {}
+    bench_schedules(results, horizons)
+    bench_estimators(results, sample_counts)
+    return({
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'date': datetime.datetime.now().isoformat(),
+            'repeat': REPEAT
+        },
+        'results': results
+    })
+
+
+def find_regressions(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Returns (name, baseline time, new time) for every benchmark
+    that got slower than baseline by more than threshold (fraction)
+    """
+    regressions = []
+    for name, seconds in results['results'].items():
+        baseline_seconds = baseline['results'].get(name)
+        if baseline_seconds is not None and seconds > baseline_seconds*(1 + threshold):
+            regressions.append((name, baseline_seconds, seconds))
+    return(regressions)
+
+
+def get_scaling_curves(results):
+    """Group results into {benchmark: ([sizes], [seconds])}"""
+    curves = {}
+    for name, seconds in results['results'].items():
+        benchmark, size = name.split('/')
+        sizes, times = curves.setdefault(benchmark, ([], []))
+        sizes.append(float(size.split('=')[1]))
+        times.append(seconds)
+    return(curves)
+
+
+def plot_scaling_curves(results):
+    from matplotlib import pyplot as plt
+    curves = get_scaling_curves(results)
+    fig, (ax_days, ax_n) = plt.subplots(1, 2, figsize=(12, 5))
+    for benchmark, (sizes, times) in curves.items():
+        ax = ax_n if benchmark in [m.__name__ for m in ESTIMATORS] else ax_days
+        ax.loglog(sizes, times, marker='o', label=benchmark)
+    ax_days.set_xlabel('horizon (days)')
+    ax_n.set_xlabel('number of samples')
+    for ax in (ax_days, ax_n):
+        ax.set_ylabel('time (s)')
+        ax.legend(fontsize='small')
+    plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against results in this file')
+    parser.add_argument('--save-baseline', help='write results as the new baseline to this file')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='relative slowdown that counts as a regression')
+    parser.add_argument('--quick', action='store_true', help='only the smaller horizons and sample counts')
+    parser.add_argument('--plot', action='store_true', help='plot scaling curves')
+    args = parser.parse_args()
+
+    if args.quick:
+        results = run(HORIZON_DAYS[:3], SAMPLE_COUNTS[:3])
+    else:
+        results = run()
+
+    for name, seconds in results['results'].items():
+        print('{:45s} {:12.6f} s'.format(name, seconds))
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as fp:
+                json.dump(results, fp, indent=4)
+
+    if args.plot:
+        plot_scaling_curves(results)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as fp:
+            baseline = json.load(fp)
+        regressions = find_regressions(results, baseline, args.threshold)
+        for name, baseline_seconds, seconds in regressions:
+            print('REGRESSION {}: {:.6f} s -> {:.6f} s ({:+.0f}%)'.format(
+                name, baseline_seconds, seconds, 100*(seconds/baseline_seconds - 1)))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
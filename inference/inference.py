@@ -4,6 +4,56 @@ from schedule import Activity, RandomSchedule
 import time
 from scipy.special import gammainccinv, gammaincinv
 import json
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache
+
+BOOTSTRAP_RESAMPLES = 10000
+BOOTSTRAP_CHUNK_SIZE = 2500
+GAMMA_TABLE_MAX_N = 1000
+GAMMA_CACHE_SIZE = 4096
+
+class GammaQuantileCache:
+    def __init__(self, max_n=GAMMA_TABLE_MAX_N):
+        """Cache of gamma quantiles for integer counts from:
+        max_n -- largest count covered by the precomputed tables (int)
+
+        A table over 0..max_n is computed once per (function, probability)
+        pair. Larger or non-integer counts fall back to an LRU cache.
+        """
+        self.max_n = max_n
+        self.tables = {}
+        self.functions = {
+            'gammainccinv': gammainccinv,
+            'gammaincinv': gammaincinv
+        }
+        self._lookup = lru_cache(maxsize=GAMMA_CACHE_SIZE)(self._compute)
+
+    def _compute(self, name, n, y):
+        return(self.functions[name](n, y))
+
+    def set_max_n(self, max_n):
+        self.max_n = max_n
+        self.tables = {}
+
+    def get_table(self, name, y):
+        key = (name, y)
+        if key not in self.tables:
+            counts = np.arange(self.max_n + 1)
+            self.tables[key] = self.functions[name](counts, y)
+        return(self.tables[key])
+
+    def quantile(self, name, n, y):
+        if n == int(n) and 0 <= n <= self.max_n:
+            return(self.get_table(name, y)[int(n)])
+        return(self._lookup(name, float(n), y))
+
+    def gammainccinv(self, n, y):
+        return(self.quantile('gammainccinv', n, y))
+
+    def gammaincinv(self, n, y):
+        return(self.quantile('gammaincinv', n, y))
+
+gamma_quantiles = GammaQuantileCache()
 
 def get_random_interval(mean_interval):
     """Generates a random interval (datetime.timedelta) using the exponential distribution"""
@@ -64,8 +114,8 @@ def gamma_tom_jack(tag_samples, tag):
 
     g = 0.75
     c = 0.95
-    low = g*gammainccinv(n, (1+c)/2)
-    high = g*gammainccinv(n+1, (1-c)/2)
+    low = g*gamma_quantiles.gammainccinv(n, (1+c)/2)
+    high = g*gamma_quantiles.gammainccinv(n+1, (1-c)/2)
     res = np.array([low, high])
     return(res/N)
 
@@ -79,8 +129,8 @@ def gamma_daniel_reeves(tag_samples, tag):
 
     g = 0.75
     c = 0.95
-    low = g*gammainccinv(n, (1+c)/2)
-    high = g*gammainccinv(n, (1-c)/2)
+    low = g*gamma_quantiles.gammainccinv(n, (1+c)/2)
+    high = g*gamma_quantiles.gammainccinv(n, (1-c)/2)
     res = np.array([low, high])
     return(res/N)
 
@@ -88,8 +138,8 @@ def gamma_brute(tag_samples, tag):
     N = len(tag_samples)
     n = np.sum(tag_samples == tag)
     c = 0.95
-    low = gammainccinv(n, (1+c)/2)
-    high = gammainccinv(n, (1-c)/2)
+    low = gamma_quantiles.gammainccinv(n, (1+c)/2)
+    high = gamma_quantiles.gammainccinv(n, (1-c)/2)
     res = np.array([low, high])
     return(res/N)
 
@@ -97,8 +147,8 @@ def gamma_brute2(tag_samples, tag):
     N = len(tag_samples)
     n = np.sum(tag_samples == tag)
     c = 0.95
-    low = gammainccinv(n, (1+c)/2)
-    high = gammainccinv(n+1, (1-c)/2)
+    low = gamma_quantiles.gammainccinv(n, (1+c)/2)
+    high = gamma_quantiles.gammainccinv(n+1, (1-c)/2)
     res = np.array([low, high])
     return(res/N)
 
@@ -106,8 +156,8 @@ def gamma_brute3(tag_samples, tag):
     N = len(tag_samples)
     n = np.sum(tag_samples == tag)
     c = 0.95
-    low = gammaincinv(n, c/2)
-    high = gammaincinv(n+1, 1-c/2)
+    low = gamma_quantiles.gammaincinv(n, c/2)
+    high = gamma_quantiles.gammaincinv(n+1, 1-c/2)
     res = np.array([low, high])
     return(res/N)
 
@@ -115,11 +165,63 @@ def gamma_wiki(tag_samples, tag):
     N = len(tag_samples)
     n = np.sum(tag_samples == tag)
     c = 0.95
-    low = gammainccinv(n, c/2)
-    high = gammainccinv(n+1, 1-c/2)
+    low = gamma_quantiles.gammainccinv(n, c/2)
+    high = gamma_quantiles.gammainccinv(n+1, 1-c/2)
     res = np.array([low, high])
     return(res/N)
 
+def _moving_block_counts(tag_samples, tag, block_length):
+    """Returns the number of tag hits in every moving block of length block_length"""
+    hits = np.concatenate(([0], np.cumsum(tag_samples == tag)))
+    return(hits[block_length:] - hits[:-block_length])
+
+def _bootstrap_shares(values, weights, n_blocks, n_resamples, seed):
+    """Draws n_resamples bootstrap tag shares in one batch.
+
+    Every resample picks n_blocks blocks, so the number of blocks picked with
+    each distinct hit count is a multinomial draw over those counts.
+    """
+    rng = np.random.default_rng(seed)
+    draws = rng.multinomial(n_blocks, weights, size=n_resamples)
+    return(draws @ values)
+
+def bootstrap_interval(tag_samples, tag, block_length=1, n_resamples=BOOTSTRAP_RESAMPLES,
+                       n_workers=1, use_processes=False, seed=None):
+    """Percentile bootstrap interval for the time share of tag.
+
+    block_length -- samples per block, >1 gives a moving block bootstrap
+    that keeps autocorrelation between consecutive samples
+    n_workers -- resample chunks are spread over a thread pool
+    (or a process pool with use_processes) when larger than 1
+    """
+    N = len(tag_samples)
+    block_length = max(1, min(block_length, N))
+    p = float(np.sum(tag_samples == tag))/N
+    c = 0.95
+
+    block_counts = _moving_block_counts(tag_samples, tag, block_length)
+    values, occurrences = np.unique(block_counts, return_counts=True)
+    weights = occurrences/float(len(block_counts))
+    n_blocks = int(np.ceil(N/float(block_length)))
+
+    chunk_sizes = [BOOTSTRAP_CHUNK_SIZE]*(n_resamples//BOOTSTRAP_CHUNK_SIZE)
+    if n_resamples % BOOTSTRAP_CHUNK_SIZE:
+        chunk_sizes.append(n_resamples % BOOTSTRAP_CHUNK_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    chunk_args = [(values, weights, n_blocks, size, s) for size, s in zip(chunk_sizes, seeds)]
+
+    if n_workers > 1:
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor_class(max_workers=n_workers) as executor:
+            chunks = list(executor.map(_bootstrap_shares, *zip(*chunk_args)))
+    else:
+        chunks = [_bootstrap_shares(*args) for args in chunk_args]
+
+    shares = np.concatenate(chunks)/float(n_blocks*block_length)
+    low, high = np.quantile(shares, [(1-c)/2, (1+c)/2])
+    res = np.array([low, p, high])
+    return(res)
+
 def main():
     """ Example usage """
     start = datetime.datetime.now()
@@ -141,6 +243,7 @@ def main():
     methods = [
         wilson_score_interval,
         normal_approximation_interval,
+        bootstrap_interval,
         gamma_tom_jack,
         gamma_daniel_reeves,
         gamma_brute,